@@ -179,6 +179,70 @@ def provision():
     print(puppet)
 
 
+@api.task
+def indexes(action='ensure'):
+    """Creates the MongoDB indexes the site needs on the server.
+
+    Safe to run on every deploy; existing indexes are left alone. Use
+    `fab real indexes:report` to see each route's query plan, with
+    collection scans flagged.
+
+    """
+    utils.fastprint("Checking MongoDB indexes ... ")
+    with api.settings(api.hide('warnings'), warn_only=True):
+        with api.cd('/projects'):
+            result = api.run('python -m dmxm.indexes %s' % action, True)
+
+    if result.failed:
+        print(colors.magenta("fail", True))
+        print(colors.magenta(result, True))
+    else:
+        print(colors.green(" ok ", True))
+        print(result)
+
+
+@api.task
+def rerender():
+    """Renders stored posts and chats with the current Markdown renderer.
+
+    Run after deploying a new RENDERER_VERSION; documents that are
+    already up to date are skipped.
+
+    """
+    utils.fastprint("Re-rendering posts and chats ... ")
+    with api.settings(api.hide('warnings'), warn_only=True):
+        with api.cd('/projects'):
+            result = api.run('python -m dmxm.render', True)
+
+    if result.failed:
+        print(colors.magenta("fail", True))
+        print(colors.magenta(result, True))
+    else:
+        print(colors.green(" ok ", True))
+        print(result)
+
+
+@api.task
+def recount():
+    """Rebuilds the chapter and campaign activity counters.
+
+    Run once after deploying the counters, while the site is quiet;
+    from then on every post and chat keeps them up to date.
+
+    """
+    utils.fastprint("Recounting posts and chats ... ")
+    with api.settings(api.hide('warnings'), warn_only=True):
+        with api.cd('/projects'):
+            result = api.run('python -m dmxm.repository recount', True)
+
+    if result.failed:
+        print(colors.magenta("fail", True))
+        print(colors.magenta(result, True))
+    else:
+        print(colors.green(" ok ", True))
+        print(result)
+
+
 @api.task(alias='test')
 def run_tests():
     """Runs unit tests upon deployment or when testing in Vagrant.
@@ -206,6 +270,62 @@ def run_tests():
         print(colors.cyan(nose, True))
 
 
+@api.task(alias='bench')
+def run_benchmarks(baseline=None):
+    """Runs the dice benchmarks on the VM or server.
+
+    Results are written to /tmp/dmxm-bench.json. Pass the path of an
+    earlier results file as `baseline` to fail on regressions; that
+    file is read before it can be overwritten, so
+    `fab vm bench:baseline=/tmp/dmxm-bench.json` checks against the
+    previous run.
+
+    """
+    utils.fastprint("Running dice benchmarks ... ")
+    command = 'python -m dmxm.benchmark --output /tmp/dmxm-bench.json'
+    if baseline:
+        command += ' --baseline %s' % baseline
+
+    with api.settings(api.hide('warnings'), warn_only=True):
+        with api.cd('/project'):
+            bench = api.run(command, True)
+
+    if bench.failed:
+        print(colors.magenta("fail", True))
+        print(colors.magenta(bench, True))
+    else:
+        print(colors.green(" ok ", True))
+        print(colors.cyan(bench, True))
+
+
+@api.task(alias='load-test')
+def load_test(concurrency=8, duration=30, baseline=None):
+    """Replays synthetic player traffic against the site on the VM.
+
+    Builds a throwaway `dmxm-load` database first, then writes results
+    to /tmp/dmxm-load.json; pass an earlier file as `baseline` to see
+    how each route's latency moved.
+
+    """
+    utils.fastprint("Running load test ... ")
+    command = ('python -m dmxm.loadtest --concurrency %s --duration %s '
+               '--output /tmp/dmxm-load.json' % (concurrency, duration))
+    if baseline:
+        command += ' --baseline %s' % baseline
+
+    with api.settings(api.hide('warnings'), warn_only=True):
+        with api.cd('/project'):
+            api.run('python -m dmxm.synthetic --drop', True)
+            load = api.run(command, True)
+
+    if load.failed:
+        print(colors.magenta("fail", True))
+        print(colors.magenta(load, True))
+    else:
+        print(colors.green(" ok ", True))
+        print(colors.cyan(load, True))
+
+
 @api.task(alias='test-build')
 def full_test_build():
     """Builds and runs the full suite of tests on this code.
@@ -259,9 +379,14 @@ def upload():
     """Copies code over to the server.
 
     Really only ever used on production deployments as the development
-    versions have the folders synced up.
+    versions have the folders synced up. The fingerprinted static
+    bundles are rebuilt first so they go up with the code.
 
     """
+    utils.fastprint("Building static bundles ... ")
+    api.local('python ./src/bundles.py', True)
+    print(colors.green(" ok ", True))
+
     utils.fastprint("Copying new code to the server ... ")
     api.put('./src/*', '/projects/dmxm/', use_sudo=True)
 
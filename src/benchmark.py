@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the DM Ex Machina dice module.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import dice, rng
+import argparse
+import json
+import random
+import sys
+import time
+
+##
+# Runs of each workload; percentiles are taken over these.
+ROUNDS = 200
+
+# Relative slowdown in ops/sec that counts as a regression.
+TOLERANCE = 0.2
+
+
+##
+def make_post(rolls, seed):
+    """Builds a reproducible combat round with `rolls` dice in it."""
+    chooser = random.Random(seed)
+    words = ['The', 'goblin', 'swings', 'wildly', 'at', 'Vlad,', 'who',
+        'ducks', 'and', 'counters', 'with', 'a', '**brutal**', 'strike.']
+    parts = []
+    for i in xrange(rolls):
+        parts.extend(chooser.sample(words, 6))
+        parts.append('%dd%d+%d' % (chooser.randint(1, 4),
+            chooser.choice([4, 6, 8, 10, 12, 20]), chooser.randint(0, 6)))
+    return ' '.join(parts)
+
+
+def workloads():
+    """Returns the named, reproducible workloads as (name, callable)."""
+    short = make_post(3, 1)
+    long_post = make_post(150, 2)
+    stream = rng.Stream(42)
+
+    return [
+        ('parse', lambda: dice.parse('4d10+5b2')),
+        ('pullout-long', lambda: dice.pullout(long_post)),
+        ('roll-1d20', lambda: dice.roll((1, 20, 4, 0), stream)),
+        ('roll-500d6', lambda: dice.roll((500, 6, 0, 0), stream)),
+        ('roll-brutal-100d20b19', lambda: dice.roll((100, 20, 0, 19),
+            stream)),
+        ('process-short', lambda: dice.process(short, stream)),
+        ('process-long', lambda: dice.process(long_post, stream)),
+    ]
+
+
+def measure(func, rounds=ROUNDS):
+    """Times `func` and returns ops/sec and latency percentiles."""
+    # Work out how many calls make a round worth timing.
+    calls = 1
+    while True:
+        start = time.time()
+        for i in xrange(calls):
+            func()
+        if time.time() - start > 0.001 or calls >= 100000:
+            break
+        calls *= 10
+
+    samples = []
+    for r in xrange(rounds):
+        start = time.time()
+        for i in xrange(calls):
+            func()
+        samples.append((time.time() - start) / calls)
+
+    samples.sort()
+
+    def pct(p):
+        return samples[min(int(len(samples) * p / 100.0), len(samples) - 1)]
+
+    return {'ops': 1.0 / (sum(samples) / len(samples)),
+        'p50': pct(50), 'p95': pct(95), 'p99': pct(99)}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Returns the workloads that are slower than the baseline."""
+    slower = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        if result['ops'] < baseline[name]['ops'] * (1 - tolerance):
+            slower.append(name)
+    return slower
+
+
+def main(argv=None):
+    """Runs the benchmarks from the command line.
+
+    Exits non-zero if `--baseline` is given and a workload regressed.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--only', help='run workloads containing this')
+    args = parser.parse_args(argv)
+
+    # Read the baseline first; it may be the file --output replaces.
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as base:
+            baseline = json.load(base)
+
+    results = {}
+    print('%-24s %12s %10s %10s %10s' % ('workload', 'ops/sec',
+        'p50 us', 'p95 us', 'p99 us'))
+    for name, func in workloads():
+        if args.only and args.only not in name:
+            continue
+        res = results[name] = measure(func, args.rounds)
+        print('%-24s %12.0f %10.1f %10.1f %10.1f' % (name, res['ops'],
+            res['p50'] * 1e6, res['p95'] * 1e6, res['p99'] * 1e6))
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        slower = compare(results, baseline, args.tolerance)
+        if slower:
+            print('Slower than baseline: %s' % ', '.join(slower))
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
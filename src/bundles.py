@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Builds fingerprinted, precompressed static bundles for DM Ex Machina.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from cssmin import cssmin
+from jsmin import jsmin
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+##
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BUILD = os.path.join(STATIC, 'build')
+MANIFEST = os.path.join(BUILD, 'manifest.json')
+
+# Bundle name: (extension, minifier, source files under static/).
+BUNDLES = {
+    'js_all': ('js', jsmin, ['jquery.js', 'main.js']),
+    'css_all': ('css', cssmin, ['reset.css', 'style.css']),
+}
+
+
+##
+def build(bundles=BUNDLES, build_dir=BUILD):
+    """Writes every bundle and its manifest; returns the manifest.
+
+    Each bundle is minified and named after a hash of its content, so
+    it can be cached forever. A .gz variant, and a .br one if brotli
+    is installed, sits next to it.
+
+    """
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+
+    manifest = {}
+    for name, (ext, minify, sources) in sorted(bundles.items()):
+        parts = []
+        for source in sources:
+            with open(os.path.join(STATIC, source)) as f:
+                parts.append(minify(f.read()))
+        content = '\n'.join(parts)
+
+        digest = hashlib.sha1(content).hexdigest()[:12]
+        filename = '%s.%s.%s' % (name, digest, ext)
+        path = os.path.join(build_dir, filename)
+
+        with open(path, 'wb') as f:
+            f.write(content)
+        compressed = gzip.open(path + '.gz', 'wb', 9)
+        compressed.write(content)
+        compressed.close()
+        if brotli:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(content))
+
+        manifest[name] = 'build/%s' % filename
+
+    with open(os.path.join(build_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+_manifest = {'mtime': None, 'bundles': {}}
+
+
+def url(name):
+    """Returns the static path of a built bundle, or None if unbuilt.
+
+    The manifest is re-read whenever a new build replaces it.
+
+    """
+    try:
+        mtime = os.path.getmtime(MANIFEST)
+    except OSError:
+        return None
+
+    if mtime != _manifest['mtime']:
+        with open(MANIFEST) as f:
+            _manifest['bundles'] = json.load(f)
+        _manifest['mtime'] = mtime
+
+    return _manifest['bundles'].get(name)
+
+
+if __name__ == '__main__':
+    for bundle, path in sorted(build().items()):
+        print('%-8s %s' % (bundle, path))
+    sys.exit(0)
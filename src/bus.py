@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Cache invalidation between DM Ex Machina worker processes.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import db
+from datetime import datetime
+from pymongo.errors import AutoReconnect, CollectionInvalid
+import logging
+import os
+import threading
+import time
+
+##
+COLLECTION = 'invalidations'
+
+# Bytes kept in the capped collection; old events simply fall off.
+CAPPED_SIZE = 1024 * 1024
+
+# Local eviction handlers by event kind, e.g. 'player'.
+HANDLERS = {}
+
+# Databases this process knows have the capped collection.
+CREATED = set()
+
+LOG = logging.getLogger(__name__)
+
+
+##
+def on(kind, handler):
+    """Calls `handler(key)` whenever a `kind` event is published."""
+    HANDLERS.setdefault(kind, []).append(handler)
+
+
+def dispatch(event):
+    """Runs the local handlers for an event document.
+
+    A failing handler is logged and skipped so the rest still run.
+
+    """
+    for handler in HANDLERS.get(event.get('kind'), []):
+        try:
+            handler(event['key'])
+        except Exception:
+            LOG.exception('Handler for %s event on %r failed',
+                event.get('kind'), event.get('key'))
+
+
+def events(database):
+    """Returns the capped collection, creating it if need be.
+
+    Only the first call for each database in a process checks with
+    the server; clear CREATED after dropping the collection.
+
+    """
+    if database.name in CREATED:
+        return database[COLLECTION]
+
+    if COLLECTION not in database.collection_names():
+        try:
+            database.create_collection(COLLECTION, capped=True,
+                size=CAPPED_SIZE)
+            # Tailable cursors need something to start from.
+            database[COLLECTION].insert({'kind': None,
+                'at': datetime.utcnow()})
+        except CollectionInvalid:
+            pass  # Another worker beat us to it.
+
+    CREATED.add(database.name)
+    return database[COLLECTION]
+
+
+def publish(database, kind, key):
+    """Tells every worker, this one included, that `key` has changed."""
+    dispatch({'kind': kind, 'key': key})
+    events(database).insert({'kind': kind, 'key': key,
+        'at': datetime.utcnow(), 'origin': os.getpid()})
+
+
+class Listener(object):
+    """Tails the capped collection and evicts local cache entries.
+
+    Starts after the newest event that exists when it is created, so
+    a new worker doesn't replay old invalidations.
+
+    """
+
+    def __init__(self, database):
+        self.database = database
+        collection = events(db.handle(database))
+        newest = list(collection.find().sort('$natural', -1).limit(1))
+        self.last = newest[0]['_id'] if newest else None
+        self.thread = None
+
+    def drain(self, await_data=False):
+        """Dispatches every event after the last one seen.
+
+        Events are read in insertion ($natural) order, skipping up to
+        the last one seen; ObjectIds from different workers don't sort
+        in that order, so `_id` ranges would miss some. If the last
+        event has already fallen off the collection, everything left
+        is dispatched again, which only costs some extra evictions.
+
+        Returns the tailable cursor so the thread can keep waiting on
+        it for more.
+
+        """
+        cursor = events(db.handle(self.database)).find(tailable=True,
+            await_data=await_data)
+        skipped = [] if self.last else None
+        for event in cursor:
+            if skipped is not None:
+                if event['_id'] == self.last:
+                    skipped = None
+                else:
+                    skipped.append(event)
+                continue
+            self.last = event['_id']
+            dispatch(event)
+
+        for event in skipped or []:
+            self.last = event['_id']
+            dispatch(event)
+        return cursor
+
+    def _run(self):
+        """The tailing thread; it runs for the life of the process.
+
+        Errors are logged and tailing starts again after a second, so
+        one bad event or query doesn't leave this worker's caches stale
+        for good.
+
+        """
+        while True:
+            try:
+                cursor = self.drain(True)
+                while cursor.alive:
+                    for event in cursor:
+                        self.last = event['_id']
+                        dispatch(event)
+            except AutoReconnect:
+                db.reset()
+            except Exception:
+                LOG.exception('Tailing %s failed; retrying', self.database)
+            time.sleep(1)
+
+    def start(self):
+        """Starts tailing in a daemon thread."""
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+##
+_listeners = {}
+_listeners_pid = None
+_lock = threading.Lock()
+
+
+def listen(database):
+    """Makes sure this process is tailing events for `database`."""
+    global _listeners_pid
+
+    if _listeners_pid == os.getpid() and database in _listeners:
+        return _listeners[database]
+
+    with _lock:
+        if _listeners_pid != os.getpid():
+            _listeners.clear()
+            _listeners_pid = os.getpid()
+        if database not in _listeners:
+            _listeners[database] = Listener(database)
+            _listeners[database].start()
+        return _listeners[database]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Small in-process caches shared by DM Ex Machina modules.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from collections import OrderedDict
+import threading
+import time
+
+
+##
+class LRUCache(object):
+    """A bounded mapping that evicts the least recently used entry.
+
+    With a `ttl` (in seconds) entries also expire that long after they
+    were stored. A `maxsize` of 0 turns the cache off. Safe to share
+    between the threads of a single mod_wsgi process.
+
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key`, marking it as recent."""
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires < time.time():
+                return default
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        """Stores `value`, evicting the oldest entry if we are full."""
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drops `key` from the cache if it is present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Empties the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return False
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Response compression middleware for DM Ex Machina.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+##
+# Content types worth compressing; anything else passes straight through.
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript')
+
+# Matches the encoding suffix tagged onto the ETags of encoded responses.
+ETAG_SUFFIX = re.compile(r'-(?:gzip|br)"')
+
+
+##
+class _Gzip(object):
+    """A gzip stream with the same interface as brotli.Compressor."""
+
+    def __init__(self, level):
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED,
+            16 + zlib.MAX_WBITS)
+
+    def process(self, data):
+        return self._zlib.compress(data)
+
+    def flush(self):
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def tag_etag(etag, encoding):
+    """Marks an ETag as belonging to the `encoding` form of a response.
+
+    The encoded bytes differ from the app's, so they can't share its
+    strong validator; `"abc"` becomes `"abc-gzip"`.
+
+    """
+    if not etag.endswith('"'):
+        return etag
+    return '%s-%s"' % (etag[:-1], encoding)
+
+
+class Compressor(object):
+    """Compresses text responses of `app` for browsers that accept it.
+
+    Brotli is preferred when the brotli module is installed, then
+    gzip. Responses shorter than `min_size` bytes, already encoded
+    ones and types outside COMPRESSIBLE are left alone. Responses
+    without a Content-Length, such as the live feeds, are compressed
+    and flushed chunk by chunk so nothing is held back.
+
+    Encoded responses get their ETag tagged with the encoding, and the
+    tag is taken back off If-None-Match before the app sees it, so the
+    app only ever deals in its own validators.
+
+    """
+
+    def __init__(self, app, level=6, brotli_quality=5, min_size=1024):
+        self.app = app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+
+    def _encoding(self, environ):
+        """Picks the best encoding the client accepts, if any."""
+        accepted = [part.split(';')[0].strip() for part in
+            environ.get('HTTP_ACCEPT_ENCODING', '').split(',')]
+        if brotli and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            return brotli.Compressor(quality=self.brotli_quality)
+        return _Gzip(self.level)
+
+    def __call__(self, environ, start_response):
+        encoding = self._encoding(environ)
+        match = environ.get('HTTP_IF_NONE_MATCH')
+        if match:
+            environ['HTTP_IF_NONE_MATCH'] = ETAG_SUFFIX.sub('"', match)
+        response = {}
+        pending = []
+
+        def start(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+            return pending.append
+
+        body = self.app(environ, start)
+        status, headers = response['status'], response['headers']
+        header = dict((k.lower(), v) for k, v in headers)
+
+        ctype = header.get('content-type', '')
+        compressible = ctype.startswith(COMPRESSIBLE)
+        if compressible:
+            vary = header.get('vary')
+            headers = [(k, v) for k, v in headers if k.lower() != 'vary']
+            headers.append(('Vary', '%s, Accept-Encoding' % vary if vary
+                else 'Accept-Encoding'))
+
+        # A 304 answers for the copy the client holds; give back the
+        # ETag it was sent with.
+        if (status[:3] == '304' and encoding and match
+                and '-%s"' % encoding in match):
+            headers = [(k, tag_etag(v, encoding) if k.lower() == 'etag'
+                else v) for k, v in headers]
+
+        length = header.get('content-length')
+        if (not encoding or not compressible or 'content-encoding' in header
+                or status[:3] in ('204', '304')
+                or (length is not None and int(length) < self.min_size)):
+            start_response(status, headers, response['exc_info'])
+            return self._passthrough(pending, body)
+
+        headers = [(k, tag_etag(v, encoding) if k.lower() == 'etag' else v)
+            for k, v in headers if k.lower() != 'content-length']
+        headers.append(('Content-Encoding', encoding))
+        start_response(status, headers, response['exc_info'])
+
+        return self._compressed(self._compressor(encoding), pending, body,
+            streaming=length is None)
+
+    def _passthrough(self, pending, body):
+        try:
+            for chunk in pending:
+                yield chunk
+            for chunk in body:
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    def _compressed(self, compressor, pending, body, streaming):
+        try:
+            for chunk in pending:
+                yield compressor.process(chunk)
+            for chunk in body:
+                data = compressor.process(chunk)
+                if streaming:
+                    data += compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
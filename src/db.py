@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Shared MongoDB client for DM Ex Machina worker processes.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from pymongo import Connection
+import os
+import threading
+
+##
+SETTINGS = {
+    'host': 'localhost',
+    'port': 27017,
+    'max_pool_size': 10,
+    'network_timeout': 10,
+    'connectTimeoutMS': 2000,
+    'w': 1,
+}
+
+STATS = {'clients': 0, 'handles': 0, 'resets': 0}
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+##
+def configure(**settings):
+    """Updates the client settings and drops any existing client.
+
+    Accepts anything `pymongo.Connection` does, e.g. `max_pool_size`,
+    `network_timeout` (seconds) or the write concern `w`.
+
+    """
+    SETTINGS.update(settings)
+    reset()
+
+
+def client():
+    """Returns this process's client, creating it on first use.
+
+    A client made before a fork is never reused in the child; Apache
+    forks its workers after the application may have been imported.
+
+    """
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+        with _lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = Connection(**SETTINGS)
+                _client_pid = os.getpid()
+                STATS['clients'] += 1
+
+    return _client
+
+
+def handle(database):
+    """Returns a cheap handle to `database` on the pooled client."""
+    STATS['handles'] += 1
+    return client()[database]
+
+
+def reset():
+    """Drops the pooled sockets, e.g. after mongod has been restarted.
+
+    The next call to client() reconnects.
+
+    """
+    global _client
+
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.disconnect()
+            STATS['resets'] += 1
+        _client = None
+
+
+def counters():
+    """Returns this process's connection lifecycle counters.
+
+    That is how many clients and handles were made and how often the
+    client was reset, plus the configured pool size. pymongo 2.x
+    doesn't expose how many pooled sockets are in use or idle, so
+    these are not pool statistics.
+
+    """
+    info = dict(STATS)
+    info['pid'] = os.getpid()
+    info['connected'] = _client is not None and _client_pid == os.getpid()
+    info['max_pool_size'] = SETTINGS['max_pool_size']
+    return info
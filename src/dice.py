@@ -5,14 +5,26 @@ Allows players to use 'XdY+Z' notation for dice rolls.
 
 """
 ##
-import random
+from dmxm import cache, rng
 import re
-import time
 
 ##
 DIEROLL = re.compile('([0-9]*)d([0-9]+)(\+[0-9]+)*(b[0-9]+)*')
 
+# Parsed schemas keyed on the expression text, e.g. '1d20+4'.
+COMPILED = cache.LRUCache(512)
+
 ##
+def _schema(groups):
+	"""Turns the groups of a DIEROLL match into a roll schema."""
+	muliplicand = 1 if not groups[0] else int(groups[0])
+	dietype = int(groups[1])
+	addend = 0 if not groups[2] else int(groups[2])
+	brutal = 0 if not groups[3] else int(groups[3][1:])
+
+	return (muliplicand, dietype, addend, brutal)
+
+
 def parse(expr):
 	"""Returns a list of integers for the dice roller."""
 	dexp = DIEROLL.match(expr)
@@ -20,54 +32,83 @@ def parse(expr):
 	if not dexp or not dexp.group(2):
 		return None
 
-	muliplicand = 1 if not dexp.group(1) else int(dexp.group(1))
-	dietype = int(dexp.group(2))
-	addend = 0 if not dexp.group(3) else int(dexp.group(3))
-	brutal = 0 if not dexp.group(4) else int(dexp.group(4)[1:])
-
-	return (muliplicand, dietype, addend, brutal)
+	return _schema(dexp.groups())
 
 
 def pullout(post):
 	"""Pulls out dice rolls from a post for later parsing."""
-	rolls = DIEROLL.findall(post)
-	ret = []
-	for each in rolls:
-		i_mult = 1 if not each[0] else int(each[0])
-		i_dietype = int(each[1])
-		i_addend = 0 if not each[2] else int(each[2])
-		i_brutal = 0 if not each[3] else int(each[3][1:])
-		item = (i_mult, i_dietype, i_addend, i_brutal)
+	return [_schema(each) for each in DIEROLL.findall(post)]
+
+
+def compiled(match):
+	"""Returns the cached schema for a DIEROLL match in a post."""
+	expr = match.group(0)
+	schema = COMPILED.get(expr)
+	if schema is None:
+		schema = _schema(match.groups())
+		COMPILED.set(expr, schema)
+
+	return schema
+
+
+def check(schema):
+	"""Raises ValueError if the dice in a schema can never be rolled."""
+	if schema[1] < 1:
+		raise ValueError('d%d has no faces to roll' % schema[1])
+	if schema[3] >= schema[1]:
+		raise ValueError('b%d rerolls every face of a d%d' % (schema[3],
+			schema[1]))
+
+
+def _total(schema, rand):
+	"""Sums one schema, drawing brutal dice straight from their range.
+
+	Rerolling anything at or under 'bN' is the same as rolling a die
+	with faces N+1 to Y, so no draws are ever thrown away.
+
+	"""
+	low = schema[3] + 1
+	span = schema[1] - schema[3]
+	total = sum([int(rand() * span) for i in xrange(schema[0])])
+
+	return total + low * schema[0] + schema[2]
+
+
+def roll_many(schemas, stream=None):
+	"""Rolls a batch of schemas at once and returns their results.
+
+	Every schema is checked before any dice are rolled. Without a
+	`stream` the process-wide one from dmxm.rng is used.
+
+	"""
+	for schema in schemas:
+		check(schema)
 
-		ret.append(item)
+	stream = stream or rng.stream()
+	stream.tick()
 
-	return ret
+	rand = stream.random
+	return [_total(schema, rand) for schema in schemas]
 
 
-def roll(schema):
+def roll(schema, stream=None):
 	"""Rolls the dice and returns a result."""
-	# Reseed the random generator each time a new die is rolled.
-	random.seed(time.ctime())
+	return roll_many([schema], stream)[0]
 
-	sums = 0
-	for i in xrange(1, schema[0]+1):
-		result = 0
-		while result <= schema[3]:
-			result = random.randint(1, schema[1])
-		sums += result
 
-	sums += schema[2]
+def process(post, stream=None):
+	"""Rolls and replaces instances of dice rolls with results.
 
-	return sums
+	The post is scanned once; each roll is substituted as it is found.
 
+	"""
+	stream = stream or rng.stream()
 
-def process(post):
-	"""Rolls and replaces instances of dice rolls with results."""
-	rolls = pullout(post)
-	if rolls:
-		for r in rolls:
-			result = roll(r)
-			thisroll = re.compile('(%d)*d(%d)(\+%d)*(b%d)*' % r)
-			post = thisroll.sub(str(result), post, 1)
+	def substitute(match):
+		# Impossible rolls are left as the player wrote them.
+		try:
+			return str(roll(compiled(match), stream))
+		except ValueError:
+			return match.group(0)
 
-	return post
+	return DIEROLL.sub(substitute, post)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""MongoDB indexes for DM Ex Machina and a report of how they are used.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import db
+from pymongo import ASCENDING, DESCENDING
+import argparse
+import sys
+
+##
+# Every index the webclient's queries rely on, by collection.
+INDEXES = {
+    'posts': [
+        [('chapter', ASCENDING), ('posted', DESCENDING), ('_id', DESCENDING)],
+        [('chapter', ASCENDING), ('players', ASCENDING),
+            ('posted', DESCENDING), ('_id', DESCENDING)],
+    ],
+    'chats': [
+        [('game', ASCENDING), ('posted', DESCENDING), ('_id', DESCENDING)],
+    ],
+    'chapters': [
+        [('game', ASCENDING), ('players', ASCENDING), ('started', ASCENDING)],
+    ],
+    'players': [
+        [('_id', ASCENDING), ('password', ASCENDING)],
+    ],
+}
+
+
+##
+def ensure(database):
+    """Creates any missing indexes; existing ones are left alone."""
+    created = []
+    for collection, indexes in sorted(INDEXES.items()):
+        for keys in indexes:
+            created.append((collection,
+                database[collection].ensure_index(keys, background=True)))
+    return created
+
+
+def route_queries(database):
+    """Returns (route, collection, query, sort) for each route's queries.
+
+    Sample values are taken from whatever data is in `database`, so
+    the plans reflect a real campaign.
+
+    """
+    chapter = database.chapters.find_one() or {}
+    player = database.players.find_one() or {}
+    game = chapter.get('game')
+    pid = player.get('_id')
+    newest = [('posted', DESCENDING), ('_id', DESCENDING)]
+
+    return [
+        ('/signin', 'players', {'_id': pid, 'password': player.get(
+            'password')}, None),
+        ('/', 'campaigns', {'_id': {'$in': player.get('games', [])}}, None),
+        ('/', 'chapters', {'game': {'$in': [game]}, 'players': pid},
+            [('started', ASCENDING)]),
+        ('/games/<g>/chapter/<c>', 'posts', {'chapter': chapter.get('_id')},
+            newest),
+        ('/games/<g>/chapter/<c>', 'posts', {'chapter': chapter.get('_id'),
+            'players': {'$in': [None, [], pid]}}, newest),
+        ('/games/<g>/chapter/<c>', 'chats', {'game': game}, newest),
+    ]
+
+
+def _plan(explained):
+    """Returns (plan summary, collection scan?, in-memory sort?)."""
+    if 'cursor' in explained:
+        # mongod before 3.0.
+        plan = explained['cursor']
+        return (plan, plan.startswith('BasicCursor'),
+            bool(explained.get('scanAndOrder')))
+
+    plan = str(explained.get('queryPlanner', {}).get('winningPlan', {}))
+    return (plan, "'COLLSCAN'" in plan, "'SORT'" in plan)
+
+
+def report(database):
+    """Explains every route query and returns one row per query."""
+    rows = []
+    for route, collection, query, sort in route_queries(database):
+        cursor = database[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan, scan, in_memory = _plan(cursor.explain())
+        rows.append({'route': route, 'collection': collection,
+            'plan': plan, 'collection_scan': scan,
+            'in_memory_sort': in_memory})
+    return rows
+
+
+def main(argv=None):
+    """Creates indexes or prints the query plan report.
+
+    Exits non-zero from `report` if any query scans a collection.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=['ensure', 'report'])
+    parser.add_argument('--database', default='dmxm')
+    args = parser.parse_args(argv)
+
+    database = db.handle(args.database)
+
+    if args.action == 'ensure':
+        for collection, name in ensure(database):
+            print('%-10s %s' % (collection, name))
+        return 0
+
+    scans = 0
+    for row in report(database):
+        flags = []
+        if row['collection_scan']:
+            flags.append('COLLECTION SCAN')
+            scans += 1
+        if row['in_memory_sort']:
+            flags.append('in-memory sort')
+        print('%-24s %-10s %s %s' % (row['route'], row['collection'],
+            ' '.join(flags) or 'ok', row['plan']))
+
+    return 1 if scans else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
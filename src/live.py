@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Live feeds of new chapter posts and chat for DM Ex Machina.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import db, loaders
+from pymongo.errors import AutoReconnect
+import Queue
+import threading
+import time
+
+##
+# Seconds between checks for new posts and chats.
+POLL_INTERVAL = 1.0
+
+# Events a slow client may fall behind by before it is dropped.
+BACKLOG = 100
+
+
+##
+class Subscription(object):
+    """One connected client's view of the topics it listens to.
+
+    `accept` is called with each (collection, document) and decides
+    whether this client may see it. `positions` holds the (posted, _id)
+    of the last document considered in each topic, so every client
+    gets everything after its own cursor however late it joined.
+
+    """
+
+    def __init__(self, topics, accept=None, positions=None):
+        self.topics = topics
+        self.accept = accept or (lambda collection, doc: True)
+        self.positions = positions or {}
+        self.queue = Queue.Queue(BACKLOG)
+        self.closed = False
+
+    def push(self, topic, doc):
+        """Queues a document, dropping the client if it has fallen behind.
+
+        Documents at or before this client's position are skipped.
+
+        """
+        position = (doc['posted'], doc['_id'])
+        if self.closed or position <= self.positions.get(topic):
+            return
+        self.positions[topic] = position
+
+        collection = topic[0]
+        if not self.accept(collection, doc):
+            return
+        try:
+            self.queue.put_nowait((collection, doc))
+        except Queue.Full:
+            self.closed = True
+
+    def get(self, timeout):
+        """Returns the next (collection, document), or None on timeout."""
+        try:
+            return self.queue.get(True, timeout)
+        except Queue.Empty:
+            return None
+
+
+class Hub(object):
+    """Fans new documents out to every subscriber in this process.
+
+    A single watcher thread polls MongoDB for each topic that has
+    subscribers, however many clients are listening to it. A topic is
+    a (collection, field, value) triple such as ('chats', 'game', g).
+
+    """
+
+    def __init__(self, database, interval=POLL_INTERVAL):
+        self.database = database
+        self.interval = interval
+        self._topics = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, topics, accept=None, after=None):
+        """Returns a Subscription to `topics`, starting the watcher.
+
+        `after` maps topics to cursors. Each topic starts after its
+        cursor, or after the newest document if it has none; anything
+        posted since the cursor is delivered on the next poll.
+
+        """
+        after = after or {}
+        positions = {}
+        for topic in topics:
+            collection, field, value = topic
+            positions[topic] = loaders.parse_cursor(after.get(topic)) or \
+                loaders.newest(db.handle(self.database)[collection],
+                    {field: value})
+        sub = Subscription(topics, accept, positions)
+
+        with self._lock:
+            for topic in topics:
+                self._topics.setdefault(topic, set()).add(sub)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        return sub
+
+    def unsubscribe(self, sub):
+        """Stops delivering to `sub`; idle topics stop being polled."""
+        sub.closed = True
+        with self._lock:
+            for topic in sub.topics:
+                if topic in self._topics:
+                    self._topics[topic].discard(sub)
+                    if not self._topics[topic]:
+                        del self._topics[topic]
+
+    def poll(self):
+        """Checks every topic once and pushes anything new.
+
+        Each topic is read once from the position of its furthest
+        behind subscriber; the others skip what they already have.
+
+        """
+        database = db.handle(self.database)
+        with self._lock:
+            topics = [(topic, list(subscribers))
+                for topic, subscribers in self._topics.items()]
+
+        for topic, subscribers in topics:
+            collection, field, value = topic
+            position = min(sub.positions.get(topic) for sub in subscribers)
+            docs = loaders.since(database[collection], {field: value},
+                position, BACKLOG)
+            for doc in docs:
+                for sub in subscribers:
+                    sub.push(topic, doc)
+
+    def _run(self):
+        """The watcher thread; exits once nobody is listening."""
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._topics:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except AutoReconnect:
+                # Keep watching through mongod restarts.
+                db.reset()
+
+
+##
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def hub(database):
+    """Returns this process's hub for `database`."""
+    with _hubs_lock:
+        if database not in _hubs:
+            _hubs[database] = Hub(database)
+        return _hubs[database]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Paged loading of posts and chat for DM Ex Machina.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import render
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+
+##
+# How cursors store the `posted` half of a (posted, _id) position.
+CURSOR_TIME = '%Y%m%d%H%M%S%f'
+
+
+##
+def cursor(doc):
+    """Returns an opaque cursor marking the position of `doc`."""
+    return encode_cursor((doc['posted'], doc['_id']))
+
+
+def encode_cursor(position):
+    """Returns the cursor for a (posted, _id) position."""
+    return '%s-%s' % (position[0].strftime(CURSOR_TIME), position[1])
+
+
+def parse_cursor(value):
+    """Returns the (posted, _id) in a cursor, or None if it is garbage."""
+    try:
+        posted, oid = value.split('-', 1)
+        return (datetime.strptime(posted, CURSOR_TIME), ObjectId(oid))
+    except (AttributeError, ValueError, InvalidId, TypeError):
+        return None
+
+
+def newest(collection, query):
+    """Returns the (posted, _id) of the newest matching document.
+
+    This is the cheap check behind conditional GETs; it reads a single
+    index entry. Returns None if nothing matches.
+
+    """
+    docs = list(collection.find(query, fields=['posted']).sort([
+        ('posted', DESCENDING), ('_id', DESCENDING)]).limit(1))
+    return (docs[0]['posted'], docs[0]['_id']) if docs else None
+
+
+def visible_to(pid, is_dm=False):
+    """Returns the part of a posts query that hides private posts.
+
+    DMs see everything. Players see posts with no `players` list (or
+    an empty one) and posts that list them.
+
+    """
+    if is_dm:
+        return {}
+    return {'players': {'$in': [None, [], pid]}}
+
+
+def with_html(collection, docs):
+    """Fills in `html` for documents stored before write-time rendering.
+
+    Loaded without their bodies, such documents are looked up again in
+    one query and rendered in memory. `python -m dmxm.render` makes
+    this a no-op.
+
+    """
+    missing = dict((doc['_id'], doc) for doc in docs
+        if doc.get('renderer') is None)
+    if missing:
+        for doc in collection.find({'_id': {'$in': missing.keys()}},
+                fields=['body']):
+            missing[doc['_id']]['html'] = render.render(doc['body'])
+
+    return docs
+
+
+def latest(collection, query, before=None, size=50, fields=None):
+    """Loads one page of a (posted, _id) ordered collection.
+
+    Without `before` this is the newest `size` documents; with it,
+    the `size` documents just older than that cursor. Returns the page
+    oldest first and the cursor for the page before it, or None if
+    this is the oldest page. `fields` limits what is loaded.
+
+    """
+    query = dict(query)
+    position = parse_cursor(before) if before else None
+    if position:
+        posted, oid = position
+        query['$or'] = [{'posted': {'$lt': posted}},
+            {'posted': posted, '_id': {'$lt': oid}}]
+
+    docs = list(collection.find(query, fields=fields).sort([
+        ('posted', DESCENDING), ('_id', DESCENDING)]).limit(size + 1))
+
+    older = cursor(docs[size - 1]) if len(docs) > size else None
+    docs = docs[:size]
+    docs.reverse()
+
+    return docs, older
+
+
+def since(collection, query, position, size=50, fields=None):
+    """Loads up to `size` documents newer than a (posted, _id) position.
+
+    Returns them oldest first. With no position this is the oldest
+    `size` documents.
+
+    """
+    query = dict(query)
+    if position:
+        posted, oid = position
+        query['$or'] = [{'posted': {'$gt': posted}},
+            {'posted': posted, '_id': {'$gt': oid}}]
+
+    return list(collection.find(query, fields=fields).sort([
+        ('posted', ASCENDING), ('_id', ASCENDING)]).limit(size))
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""HTTP load tests for DM Ex Machina against synthetic campaigns.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import db, synthetic
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+import argparse
+import cookielib
+import json
+import random
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+##
+# How often each kind of request is made, roughly like a live session.
+MIX = [
+    ('chapter', 60),
+    ('chat', 15),
+    ('homepage', 10),
+    ('post', 10),
+    ('signin', 5),
+]
+
+
+##
+class SignedOut(Exception):
+    """The site sent a simulated player back to the login page."""
+
+
+class NoRedirect(urllib2.HTTPRedirectHandler):
+    """Stops at redirects, so a POST is timed on its own."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Player(object):
+    """One simulated player with their own cookies."""
+
+    def __init__(self, url, pid, chapters):
+        self.url = url
+        self.pid = pid
+        self.chapters = chapters
+        self.opener = urllib2.build_opener(NoRedirect,
+            urllib2.HTTPCookieProcessor(cookielib.CookieJar()))
+
+    def request(self, path, data=None, home=False):
+        """Makes a request and returns the page, or None for a redirect.
+
+        Redirects count as success unless they go back to the login
+        page, which raises SignedOut; pass `home` where that is the
+        normal answer.
+
+        """
+        if data is not None:
+            data = urllib.urlencode(data)
+        try:
+            return self.opener.open(self.url + path, data).read()
+        except urllib2.HTTPError as e:
+            if e.code not in (301, 302, 303):
+                raise
+            location = urlparse.urlparse(e.headers.get('Location', '')).path
+            if not home and location in ('', '/', '/signin'):
+                raise SignedOut('%s sent %s to %s' % (path, self.pid,
+                    location or 'nowhere'))
+
+    def sign_in(self):
+        """Signs in and returns whether the session works."""
+        self.request('/signin', {'pid': self.pid,
+            'password': synthetic.PASSWORD}, home=True)
+        return '/signout' in (self.request('/') or '')
+
+    def act(self, action, chooser):
+        game, chapter = chooser.choice(self.chapters)
+        if action == 'signin':
+            self.request('/signin', {'pid': self.pid,
+                'password': synthetic.PASSWORD}, home=True)
+        elif action == 'homepage':
+            self.request('/')
+        elif action == 'chapter':
+            self.request('/games/%s/chapter/%s' % (game, chapter))
+        elif action == 'post':
+            self.request('/games/%s/chapter/%s/post' % (game, chapter),
+                {'post-text': synthetic.body(chooser)})
+        elif action == 'chat':
+            self.request('/games/%s/chat' % game,
+                {'post-text': synthetic.sentence(chooser, 6)})
+
+
+def players(database, url):
+    """Builds a Player for every synthetic player in `database`."""
+    found = []
+    for player in database.players.find({'synthetic': True}):
+        chapters = [(c['game'], c['_id']) for c in database.chapters.find(
+            {'game': {'$in': player['games']}, 'players': player['_id']},
+            fields=['game'])]
+        if chapters:
+            found.append(Player(url, player['_id'], chapters))
+    return found
+
+
+def percentile(samples, pct):
+    return samples[min(int(len(samples) * pct / 100.0), len(samples) - 1)]
+
+
+def run(everyone, concurrency, duration, seed=1):
+    """Drives traffic for `duration` seconds and returns the results."""
+    timings = dict((action, []) for action, weight in MIX)
+    errors = dict((action, 0) for action, weight in MIX)
+    lock = threading.Lock()
+    deadline = time.time() + duration
+    weighted = [action for action, weight in MIX for i in xrange(weight)]
+
+    def worker(n):
+        chooser = random.Random(seed + n)
+        player = everyone[n % len(everyone)]
+        if not player.sign_in():
+            with lock:
+                errors['signin'] += 1
+            return
+        while time.time() < deadline:
+            action = chooser.choice(weighted)
+            start = time.time()
+            try:
+                player.act(action, chooser)
+                failed = False
+            except Exception:
+                failed = True
+            elapsed = time.time() - start
+            with lock:
+                if failed:
+                    errors[action] += 1
+                else:
+                    timings[action].append(elapsed)
+
+    started = time.time()
+    threads = [threading.Thread(target=worker, args=(n,))
+        for n in xrange(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    results = {'concurrency': concurrency, 'duration': elapsed,
+        'throughput': sum(len(t) for t in timings.values()) / elapsed,
+        'routes': {}}
+    for action, samples in timings.items():
+        samples.sort()
+        route = results['routes'][action] = {'count': len(samples),
+            'errors': errors[action]}
+        if samples:
+            route.update({'p50': percentile(samples, 50),
+                'p95': percentile(samples, 95),
+                'p99': percentile(samples, 99),
+                'throughput': len(samples) / elapsed})
+    return results
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(database, port):
+    """Serves the webclient on a local threaded WSGI server."""
+    from dmxm import webclient
+    webclient.DATABASE = database
+
+    server = make_server('127.0.0.1', port, webclient.APP,
+        ThreadingWSGIServer, QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def report(results, baseline=None):
+    """Prints per-route latencies, with changes against a baseline."""
+    print('%-10s %8s %7s %9s %9s %9s' % ('route', 'count', 'errors',
+        'p50 ms', 'p95 ms', 'p99 ms'))
+    for action, route in sorted(results['routes'].items()):
+        line = '%-10s %8d %7d' % (action, route['count'], route['errors'])
+        for pct in ('p50', 'p95', 'p99'):
+            line += ' %9.1f' % (route.get(pct, 0) * 1000)
+        if baseline and route.get('p95') and \
+                baseline['routes'].get(action, {}).get('p95'):
+            line += '  (p95 %+.0f%%)' % ((route['p95'] /
+                baseline['routes'][action]['p95'] - 1) * 100)
+        print(line)
+    print('%.1f requests/sec at concurrency %d' % (results['throughput'],
+        results['concurrency']))
+
+
+def main(argv=None):
+    """Runs a load test from the command line.
+
+    Generate a dataset with `python -m dmxm.synthetic` first.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='dmxm-load')
+    parser.add_argument('--url', help='test a running server instead')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    args = parser.parse_args(argv)
+
+    url = args.url
+    if not url:
+        serve(args.database, args.port)
+        url = 'http://127.0.0.1:%d' % args.port
+
+    everyone = players(db.handle(args.database), url)
+    if not everyone:
+        parser.error('no synthetic players in %s' % args.database)
+    if not everyone[0].sign_in():
+        parser.error('could not sign in as %s; is %s using the %s '
+            'database?' % (everyone[0].pid, url, args.database))
+
+    results = run(everyone, args.concurrency, args.duration)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
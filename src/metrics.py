@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Request and MongoDB query metrics for DM Ex Machina.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from pymongo.collection import Collection
+import threading
+import time
+
+##
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+##
+class Histogram(object):
+    """A cumulative histogram in the shape Prometheus expects."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Route(object):
+    """Everything recorded for one route in this process."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.requests = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.timers = {}
+
+
+ROUTES = {}
+
+
+class Request(object):
+    """What one request has done so far; see begin() and end()."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.queries = []
+        self.timers = {}
+
+
+##
+def begin():
+    """Starts recording a request on this thread."""
+    _local.request = Request()
+
+
+def current():
+    """Returns the Request being recorded on this thread, or None."""
+    return getattr(_local, 'request', None)
+
+
+def end(route):
+    """Stops recording and files the request under `route`.
+
+    Returns the finished Request, with its `elapsed` seconds set.
+
+    """
+    req = current()
+    if req is None:
+        return None
+    _local.request = None
+    req.elapsed = time.time() - req.start
+
+    with _lock:
+        stats = ROUTES.setdefault(route, Route())
+        stats.requests += 1
+        stats.latency.observe(req.elapsed)
+        stats.queries += len(req.queries)
+        stats.query_seconds += sum(seconds for name, seconds in req.queries)
+        for kind, seconds in req.timers.items():
+            stats.timers[kind] = stats.timers.get(kind, 0.0) + seconds
+
+    return req
+
+
+def record_query(name, seconds):
+    """Adds a MongoDB query to the current request, if there is one."""
+    req = current()
+    if req is not None:
+        req.queries.append((name, seconds))
+
+
+class timer(object):
+    """Times a block as `kind` (e.g. 'template') in the current request."""
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        req = current()
+        if req is not None:
+            req.timers[self.kind] = (req.timers.get(self.kind, 0.0) +
+                time.time() - self.start)
+
+
+##
+def _timed(name, func):
+    """Wraps a collection method so its calls are recorded as queries."""
+    def timed(*args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record_query(name, time.time() - start)
+    return timed
+
+
+class InstrumentedCursor(object):
+    """A cursor that records the time spent fetching its results."""
+
+    def __init__(self, cursor, name):
+        self._cursor = cursor
+        self._name = name
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in ('sort', 'limit', 'skip', 'hint', 'batch_size'):
+            def chained(*args, **kwargs):
+                attr(*args, **kwargs)
+                return self
+            return chained
+        if name in ('count', 'explain', 'distinct'):
+            return _timed('%s.%s' % (self._name, name), attr)
+        return attr
+
+    def __iter__(self):
+        spent = 0.0
+        try:
+            while True:
+                start = time.time()
+                try:
+                    doc = self._cursor.next()
+                finally:
+                    spent += time.time() - start
+                yield doc
+        except StopIteration:
+            pass
+        finally:
+            record_query(self._name, spent)
+
+
+class InstrumentedCollection(object):
+    """A collection whose queries are recorded against the request."""
+
+    TIMED = ('find_one', 'insert', 'update', 'remove', 'save', 'count',
+        'find_and_modify', 'ensure_index')
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        qualified = '%s.%s' % (self._collection.name, name)
+        if name in self.TIMED:
+            return _timed(qualified, attr)
+        if name == 'find':
+            return lambda *args, **kwargs: InstrumentedCursor(
+                attr(*args, **kwargs), qualified)
+        return attr
+
+
+class InstrumentedDatabase(object):
+    """Wraps a pymongo Database so that every query is recorded."""
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        attr = getattr(self._database, name)
+        if isinstance(attr, Collection):
+            return InstrumentedCollection(attr)
+        return attr
+
+    def __getitem__(self, name):
+        return InstrumentedCollection(self._database[name])
+
+
+##
+def breakdown(req):
+    """Describes a finished request's queries and timers for the log."""
+    parts = ['%s %.1fms' % (name, seconds * 1000)
+        for name, seconds in req.queries]
+    parts.extend('%s %.1fms' % (kind, seconds * 1000)
+        for kind, seconds in sorted(req.timers.items()))
+    return ', '.join(parts)
+
+
+def prometheus():
+    """Renders this process's metrics in the Prometheus text format."""
+    lines = ['# TYPE dmxm_request_seconds histogram']
+    with _lock:
+        routes = sorted(ROUTES.items())
+        for route, stats in routes:
+            for bound, count in zip(stats.latency.buckets,
+                    stats.latency.counts):
+                lines.append('dmxm_request_seconds_bucket{route="%s",'
+                    'le="%s"} %d' % (route, bound, count))
+            lines.append('dmxm_request_seconds_bucket{route="%s",le="+Inf"} '
+                '%d' % (route, stats.latency.count))
+            lines.append('dmxm_request_seconds_sum{route="%s"} %f' % (route,
+                stats.latency.sum))
+            lines.append('dmxm_request_seconds_count{route="%s"} %d' % (
+                route, stats.latency.count))
+
+        lines.append('# TYPE dmxm_mongo_queries_total counter')
+        for route, stats in routes:
+            lines.append('dmxm_mongo_queries_total{route="%s"} %d' % (route,
+                stats.queries))
+
+        lines.append('# TYPE dmxm_mongo_seconds_total counter')
+        for route, stats in routes:
+            lines.append('dmxm_mongo_seconds_total{route="%s"} %f' % (route,
+                stats.query_seconds))
+
+        lines.append('# TYPE dmxm_timer_seconds_total counter')
+        for route, stats in routes:
+            for kind, seconds in sorted(stats.timers.items()):
+                lines.append('dmxm_timer_seconds_total{route="%s",kind="%s"}'
+                    ' %f' % (route, kind, seconds))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Exact outcome distributions for DM Ex Machina dice expressions.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import cache, dice
+from fractions import Fraction
+import math
+
+##
+# Anything bigger than this is not a roll anybody is going to make.
+MAX_DICE = 1000
+
+# Exact distributions cost about dice x outcomes additions; this many
+# takes tens of milliseconds. Bigger rolls of at least APPROXIMATE_FROM
+# dice use a normal approximation, and anything else is refused.
+MAX_WORK = 250000
+APPROXIMATE_FROM = 30
+
+# Distributions keyed on the (count, sides, addend, brutal) schema.
+DISTRIBUTIONS = cache.LRUCache(256)
+
+
+##
+def _add_die(ways, faces):
+    """Adds one die with `faces` equally likely faces to a distribution.
+
+    Each outcome of the sum is a sliding window over the previous
+    distribution, so this is linear in the number of outcomes.
+
+    """
+    out = [0] * (len(ways) + faces - 1)
+    window = 0
+    for i in xrange(len(out)):
+        if i < len(ways):
+            window += ways[i]
+        if i >= faces:
+            window -= ways[i - faces]
+        out[i] = window
+    return out
+
+
+def _work(schema):
+    """Roughly how many additions an exact Distribution would take."""
+    count, sides, addend, brutal = schema
+    return count * (count * (sides - brutal - 1) + 1)
+
+
+class Distribution(object):
+    """The exact outcome distribution of a single dice expression.
+
+    `ways[i]` is the number of equally likely rolls that total
+    `low + i`, out of `total` rolls in all.
+
+    """
+
+    def __init__(self, schema):
+        count, sides, addend, brutal = schema
+        faces = sides - brutal
+
+        self.schema = schema
+        self.ways = [1]
+        for i in xrange(count):
+            self.ways = _add_die(self.ways, faces)
+        self.total = faces ** count
+        self.low = count * (brutal + 1) + addend
+        self.high = self.low + len(self.ways) - 1
+
+    def mean(self):
+        """Returns the expected value of a roll."""
+        count, sides, addend, brutal = self.schema
+        return count * (brutal + 1 + sides) / 2.0 + addend
+
+    def at_least(self, target):
+        """Returns the probability of rolling `target` or more."""
+        start = max(target - self.low, 0)
+        return float(Fraction(sum(self.ways[start:]), self.total))
+
+    def percentile(self, pct):
+        """Returns the smallest result covering `pct` percent of rolls."""
+        needed = self.total * pct
+        seen = 0
+        for i, ways in enumerate(self.ways):
+            seen += ways
+            if seen * 100 >= needed:
+                return self.low + i
+        return self.high
+
+
+class Approximation(object):
+    """A normal approximation to the outcomes of a big roll.
+
+    Answers the same questions as Distribution, to within a fraction
+    of a percent for the rolls it is used for.
+
+    """
+
+    def __init__(self, schema):
+        count, sides, addend, brutal = schema
+        faces = sides - brutal
+
+        self.schema = schema
+        self.low = count * (brutal + 1) + addend
+        self.high = count * sides + addend
+        self.sd = math.sqrt(count * (faces ** 2 - 1) / 12.0)
+
+    def mean(self):
+        """Returns the expected value of a roll."""
+        return (self.low + self.high) / 2.0
+
+    def _below(self, result):
+        """The chance of rolling `result` or less."""
+        if result < self.low:
+            return 0.0
+        if result >= self.high:
+            return 1.0
+        z = (result + 0.5 - self.mean()) / (self.sd * math.sqrt(2))
+        return 0.5 * (1 + math.erf(z))
+
+    def at_least(self, target):
+        """Returns the probability of rolling `target` or more."""
+        return 1.0 - self._below(target - 1)
+
+    def percentile(self, pct):
+        """Returns the smallest result covering `pct` percent of rolls."""
+        low, high = self.low, self.high
+        while low < high:
+            middle = (low + high) // 2
+            if self._below(middle) * 100 >= pct:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+
+def distribution(schema):
+    """Returns the memoized Distribution or Approximation for a schema.
+
+    Raises ValueError for rolls too big to work out quickly.
+
+    """
+    dist = DISTRIBUTIONS.get(schema)
+    if dist is None:
+        dice.check(schema)
+        if schema[0] > MAX_DICE:
+            raise ValueError('more than %d dice in one roll' % MAX_DICE)
+
+        if _work(schema) <= MAX_WORK:
+            dist = Distribution(schema)
+        elif schema[0] >= APPROXIMATE_FROM:
+            dist = Approximation(schema)
+        else:
+            raise ValueError('too many sides to work out the odds')
+        DISTRIBUTIONS.set(schema, dist)
+
+    return dist
+
+
+def summarize(expr, target=None, percentiles=(5, 25, 50, 75, 95)):
+    """Summarizes the odds of a dice expression for the odds endpoint.
+
+    Returns None if `expr` is not a dice expression; raises ValueError
+    for expressions that can never be rolled.
+
+    """
+    schema = dice.parse(expr)
+    if not schema:
+        return None
+
+    dist = distribution(schema)
+    summary = {'expr': expr, 'min': dist.low, 'max': dist.high,
+        'mean': dist.mean(), 'exact': isinstance(dist, Distribution),
+        'percentiles': dict((str(p), dist.percentile(p))
+            for p in percentiles)}
+
+    if target is not None:
+        summary['target'] = target
+        summary['at_least'] = dist.at_least(target)
+
+    return summary
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""On-demand request profiling for DM Ex Machina admins.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from collections import defaultdict
+from datetime import datetime
+import cProfile
+import itertools
+import os
+import random
+import re
+import sys
+import thread
+import threading
+import time
+
+##
+# Where call graphs (.prof) and flame graph stacks (.folded) are kept,
+# and how many profiles to keep there; older ones are deleted.
+PROFILE_DIR = '/tmp/dmxm-profiles'
+MAX_PROFILES = 50
+
+# Fraction of all requests to profile, and at most how many a minute.
+SAMPLE_RATE = 0.0
+SAMPLES_PER_MINUTE = 2
+
+# Seconds between stack samples for the flame graph.
+SAMPLE_INTERVAL = 0.005
+
+_last_sample = [0.0]
+_lock = threading.Lock()
+_saved = itertools.count(1)
+
+
+##
+def should_sample():
+    """Decides whether to profile an ordinary request.
+
+    At most SAMPLES_PER_MINUTE requests a minute are picked, per
+    process, however high SAMPLE_RATE is.
+
+    """
+    if not SAMPLE_RATE or random.random() >= SAMPLE_RATE:
+        return False
+
+    with _lock:
+        now = time.time()
+        if now - _last_sample[0] < 60.0 / SAMPLES_PER_MINUTE:
+            return False
+        _last_sample[0] = now
+        return True
+
+
+class Sampler(object):
+    """Samples one thread's stack from another to build a flame graph."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self._running = False
+        self._thread = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name,
+                os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        if stack:
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+
+    def _run(self):
+        while self._running:
+            self._sample()
+            time.sleep(self.interval)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+
+    def folded(self):
+        """The samples in the collapsed format flamegraph.pl reads."""
+        return ''.join('%s %d\n' % (stack, count)
+            for stack, count in sorted(self.stacks.items()))
+
+
+class Profile(object):
+    """Profiles the rest of the current request on this thread.
+
+    cProfile gives the call graph; the sampler gives real stacks for a
+    flame graph. Both are saved under PROFILE_DIR by stop().
+
+    """
+
+    def __init__(self):
+        self.cprofile = cProfile.Profile()
+        self.sampler = Sampler(thread.get_ident())
+
+    def start(self):
+        self.started = time.time()
+        self.sampler.start()
+        self.cprofile.enable()
+
+    def stop(self, label):
+        """Stops profiling and saves the results; returns their name."""
+        self.cprofile.disable()
+        self.sampler.stop()
+
+        if not os.path.isdir(PROFILE_DIR):
+            os.makedirs(PROFILE_DIR)
+
+        name = '%s-%d-%d-%s' % (time.strftime('%Y%m%d%H%M%S',
+            time.gmtime(self.started)), os.getpid(), next(_saved),
+            re.sub('[^A-Za-z0-9]+', '_', label).strip('_') or 'root')
+        self.cprofile.dump_stats(os.path.join(PROFILE_DIR, name + '.prof'))
+        with open(os.path.join(PROFILE_DIR, name + '.folded'), 'w') as f:
+            f.write(self.sampler.folded())
+
+        prune()
+        return name
+
+
+def prune(keep=None):
+    """Deletes all but the newest `keep` (MAX_PROFILES) profiles."""
+    keep = MAX_PROFILES if keep is None else keep
+    for profile in listing()[keep:]:
+        for suffix in ('.prof', '.folded'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile['name'] + suffix))
+            except OSError:
+                pass  # Another worker pruned it first.
+
+
+def listing():
+    """Returns the saved profiles, newest first, as dicts."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    profiles = []
+    for filename in os.listdir(PROFILE_DIR):
+        if not filename.endswith('.prof'):
+            continue
+        path = os.path.join(PROFILE_DIR, filename)
+        try:
+            profiles.append({'name': filename[:-len('.prof')],
+                'saved': datetime.utcfromtimestamp(os.path.getmtime(path)),
+                'size': os.path.getsize(path)})
+        except OSError:
+            continue  # Pruned by another worker.
+
+    profiles.sort(key=lambda p: p['saved'], reverse=True)
+    return profiles
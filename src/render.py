@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Write-time Markdown rendering for chapter posts and chat messages.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import db
+import argparse
+import markdown
+import sys
+
+##
+# Bump this whenever render() changes; backfill() re-renders anything
+# stored by an older version.
+RENDERER_VERSION = 1
+
+COLLECTIONS = ('posts', 'chats')
+
+
+##
+def render(body):
+    """Returns sanitized HTML for a Markdown post body.
+
+    Raw HTML in the body is escaped rather than passed through.
+
+    """
+    return markdown.markdown(body, safe_mode='escape')
+
+
+def rendered(doc):
+    """Adds the rendered `html` and renderer version to a document."""
+    doc['html'] = render(doc['body'])
+    doc['renderer'] = RENDERER_VERSION
+    return doc
+
+
+def backfill(database, collections=COLLECTIONS):
+    """Renders every document stored without the current renderer.
+
+    Returns the number of documents updated in each collection.
+
+    """
+    counts = {}
+    for name in collections:
+        collection = database[name]
+        stale = collection.find({'renderer': {'$ne': RENDERER_VERSION}},
+            fields=['body'])
+
+        counts[name] = 0
+        for doc in stale:
+            collection.update({'_id': doc['_id']}, {'$set': {
+                'html': render(doc['body']), 'renderer': RENDERER_VERSION}})
+            counts[name] += 1
+
+    return counts
+
+
+def main(argv=None):
+    """Runs the backfill from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='dmxm')
+    args = parser.parse_args(argv)
+
+    counts = backfill(db.handle(args.database))
+    for name, count in sorted(counts.items()):
+        print('%-10s %d re-rendered' % (name, count))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""Typed access to the DM Ex Machina collections.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import cache, loaders, render
+from datetime import datetime
+from hashlib import sha256
+from pymongo import ASCENDING, DESCENDING
+import argparse
+import dmxm.db
+import sys
+
+##
+# Cross-request cache of players; off until given a size, e.g.
+# `repository.PLAYERS.maxsize = 1000`.
+PLAYERS = cache.LRUCache(0, ttl=60)
+
+# Campaign and chapter metadata hardly ever changes, so it is cached
+# by default. Writers publish 'campaign' and 'chapter' events on
+# dmxm.bus; the TTL bounds how long a missed event can go unnoticed.
+CAMPAIGNS = cache.LRUCache(1000, ttl=60)
+CHAPTERS = cache.LRUCache(1000, ttl=60)
+
+
+##
+class Record(object):
+    """The fields of a document that the site uses, and nothing else.
+
+    Subclasses list those fields in FIELDS, which doubles as the
+    projection they are loaded with. Records are shared between
+    requests through the caches above; don't modify them.
+
+    """
+    __slots__ = ('_id',)
+    FIELDS = ()
+
+    def __init__(self, doc):
+        self._id = doc['_id']
+        for name in self.FIELDS:
+            setattr(self, name, doc.get(name))
+
+    def __repr__(self):
+        return '%s(%r, %s)' % (type(self).__name__, self._id, ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.FIELDS))
+
+
+class Player(Record):
+    """A player; never carries their password hash.
+
+    `seen` holds how many chats and posts in each chapter the player
+    had seen, by seen_key(game): `{key: {'chats': n, 'posts':
+    {chapter: n}}}`.
+
+    """
+    FIELDS = ('games', 'admin', 'seen')
+    __slots__ = FIELDS
+
+    def __init__(self, doc):
+        super(Player, self).__init__(doc)
+        self.games = self.games or []
+        self.admin = bool(self.admin)
+        self.seen = self.seen or {}
+
+
+class Campaign(Record):
+    """A campaign, and the chapters of it a player is in if loaded.
+
+    The activity counters are kept up to date by add_post() and
+    chats_added(); private posts aren't counted. They are only fresh
+    in records from campaigns_with_chapters(), not cached ones.
+
+    """
+    FIELDS = ('name', 'dms', 'started', 'post_count', 'last_post',
+        'last_poster', 'chat_count', 'last_chat')
+    __slots__ = FIELDS + ('chapters',)
+
+    def __init__(self, doc):
+        super(Campaign, self).__init__(doc)
+        self.dms = self.dms or []
+        self.post_count = self.post_count or 0
+        self.chat_count = self.chat_count or 0
+        self.chapters = []
+
+
+class Chapter(Record):
+    """A chapter's name, game, lock state, players and post counter."""
+    FIELDS = ('name', 'game', 'started', 'locked', 'players', 'post_count',
+        'last_post', 'last_poster')
+    __slots__ = FIELDS
+
+    def __init__(self, doc):
+        super(Chapter, self).__init__(doc)
+        self.players = self.players or []
+        self.post_count = self.post_count or 0
+
+
+class Chat(Record):
+    """A chat message as chatbox.html and the live feeds show it.
+
+    Documents stored before write-time rendering are rendered from
+    their body, if they have one, or by loaders.with_html.
+
+    """
+    FIELDS = ('source', 'posted', 'html')
+    __slots__ = FIELDS
+
+    def __init__(self, doc):
+        super(Chat, self).__init__(doc)
+        if self.html is None and 'body' in doc:
+            self.html = render.render(doc['body'])
+
+
+class Post(Chat):
+    """A chapter post; `players` lists who may see a private one."""
+    FIELDS = Chat.FIELDS + ('players',)
+    __slots__ = ('players',)
+
+
+def fields(record):
+    """The projection to load `record` with, for loaders.with_html."""
+    return list(record.FIELDS) + ['renderer']
+
+
+##
+def player(db, pid):
+    """Returns the Player `pid`, or None."""
+    user = PLAYERS.get(pid)
+    if user is None:
+        doc = db.players.find_one({'_id': pid}, fields=Player.FIELDS)
+        if doc:
+            user = Player(doc)
+            PLAYERS.set(pid, user)
+
+    return user
+
+
+def check_password(db, pid, password):
+    """Whether `password` is the one `pid` signs in with."""
+    doc = db.players.find_one({'_id': pid,
+        'password': sha256(password).hexdigest()}, fields=['_id'])
+    return doc is not None
+
+
+def campaign(db, game):
+    """Returns the Campaign `game`, or None."""
+    record = CAMPAIGNS.get(game)
+    if record is None:
+        doc = db.campaigns.find_one({'_id': game}, fields=Campaign.FIELDS)
+        if doc:
+            record = Campaign(doc)
+            CAMPAIGNS.set(game, record)
+
+    return record
+
+
+def chapter(db, oid):
+    """Returns the Chapter `oid`, or None."""
+    record = CHAPTERS.get(oid)
+    if record is None:
+        doc = db.chapters.find_one({'_id': oid}, fields=Chapter.FIELDS)
+        if doc:
+            record = Chapter(doc)
+            CHAPTERS.set(oid, record)
+
+    return record
+
+
+def forget_player(pid):
+    """Drops a cached player; call after writing to their document."""
+    PLAYERS.invalidate(pid)
+
+
+def forget_campaign(game):
+    """Drops a cached campaign; call after writing to its document."""
+    CAMPAIGNS.invalidate(game)
+
+
+def forget_chapter(oid):
+    """Drops a cached chapter; call after writing to its document."""
+    CHAPTERS.invalidate(oid)
+
+
+def campaigns_with_chapters(db, pid, games):
+    """Loads campaigns with the chapters `pid` plays in, in two queries.
+
+    Returns Campaigns in the order of `games`, each with its `chapters`
+    sorted by start date, which is the shape that sessions.html
+    expects. Campaigns that no longer exist are skipped. These are
+    fresh records, not the cached ones.
+
+    """
+    games = list(games)
+    if not games:
+        return []
+
+    campaigns = dict((doc['_id'], Campaign(doc)) for doc in
+        db.campaigns.find({'_id': {'$in': games}}, fields=Campaign.FIELDS))
+
+    chapters = db.chapters.find({'game': {'$in': games}, 'players': pid},
+        fields=Chapter.FIELDS).sort('started', ASCENDING)
+
+    for doc in chapters:
+        if doc['game'] in campaigns:
+            campaigns[doc['game']].chapters.append(Chapter(doc))
+
+    return [campaigns[game] for game in games if game in campaigns]
+
+
+##
+def _posts_query(chapter, pid, is_dm):
+    query = loaders.visible_to(pid, is_dm)
+    query['chapter'] = chapter
+    return query
+
+
+def _page(collection, record, query, before, size):
+    docs, older = loaders.latest(collection, query, before, size,
+        fields(record))
+    loaders.with_html(collection, docs)
+    return [record(doc) for doc in docs], older
+
+
+def _delta(collection, record, query, after, size):
+    position = loaders.parse_cursor(after) if after else None
+    if not position:
+        return _page(collection, record, query, None, size)[0]
+
+    docs = loaders.since(collection, query, position, size, fields(record))
+    loaders.with_html(collection, docs)
+    return [record(doc) for doc in docs]
+
+
+def newest_post(db, chapter):
+    """The (posted, _id) of the newest post in `chapter`, or None."""
+    return loaders.newest(db.posts, {'chapter': chapter})
+
+
+def newest_chat(db, game):
+    """The (posted, _id) of the newest chat message in `game`, or None."""
+    return loaders.newest(db.chats, {'game': game})
+
+
+def posts(db, chapter, pid, is_dm=False, before=None, size=50):
+    """One page of the posts in `chapter` that `pid` may see.
+
+    Returns the Posts oldest first and the cursor for the page before,
+    as loaders.latest does.
+
+    """
+    return _page(db.posts, Post, _posts_query(chapter, pid, is_dm),
+        before, size)
+
+
+def posts_after(db, chapter, pid, is_dm=False, after=None, size=50):
+    """The Posts `pid` may see after the cursor `after`.
+
+    Without a usable cursor this is the latest page.
+
+    """
+    return _delta(db.posts, Post, _posts_query(chapter, pid, is_dm),
+        after, size)
+
+
+def chats(db, game, before=None, size=50):
+    """One page of chat messages in `game`, like posts()."""
+    return _page(db.chats, Chat, {'game': game}, before, size)
+
+
+def chats_after(db, game, after=None, size=50):
+    """The Chats in `game` after the cursor `after`, like posts_after()."""
+    return _delta(db.chats, Chat, {'game': game}, after, size)
+
+
+##
+def add_post(db, chapter, source, body, players=None):
+    """Stores a new post in the Chapter `chapter` and returns it.
+
+    Public posts also bump the chapter's and campaign's counters.
+
+    """
+    post = {'chapter': chapter._id, 'body': body,
+        'posted': datetime.utcnow(), 'source': source}
+    if players is not None:
+        post['players'] = players
+
+    db.posts.insert(render.rendered(post))
+
+    if not players:
+        update = {'$inc': {'post_count': 1}, '$set': {
+            'last_post': post['posted'], 'last_poster': source}}
+        db.chapters.update({'_id': chapter._id}, update)
+        db.campaigns.update({'_id': chapter.game}, update)
+
+    return post
+
+
+def new_chat(game, source, body):
+    """Returns a rendered chat message document, ready to be stored."""
+    return render.rendered({'game': game, 'body': body, 'source': source,
+        'posted': datetime.utcnow()})
+
+
+def add_chat(db, chat):
+    """Stores a chat message made with new_chat()."""
+    db.chats.insert(chat)
+    chats_added(db, [chat])
+    return chat
+
+
+def chats_added(db, chats):
+    """Bumps the chat counters of campaigns for stored chat messages.
+
+    Takes a whole write-behind batch; each game is updated once.
+
+    """
+    games = {}
+    for chat in chats:
+        count, last = games.get(chat['game'], (0, chat['posted']))
+        games[chat['game']] = (count + 1, max(last, chat['posted']))
+
+    for game, (count, last) in games.items():
+        db.campaigns.update({'_id': game}, {'$inc': {'chat_count': count},
+            '$set': {'last_chat': last}})
+
+
+def seen_key(game):
+    """The key under Player.seen for `game`, safe in a dotted path."""
+    return game.encode('utf-8').encode('hex')
+
+
+def counts(db, game, chapter):
+    """The (posts, chats) counters of a chapter and its game.
+
+    Read fresh, not from cached records; take them before loading the
+    page they are passed to mark_seen() for.
+
+    """
+    posts = (db.chapters.find_one({'_id': chapter},
+        fields=['post_count']) or {}).get('post_count', 0)
+    chats = (db.campaigns.find_one({'_id': game},
+        fields=['chat_count']) or {}).get('chat_count', 0)
+    return posts, chats
+
+
+def mark_seen(db, player, game, chapter, seen_counts):
+    """Records that `player` is up to date with a chapter and its chat.
+
+    `seen_counts` are the counts() from before the page was loaded, so
+    anything posted since stays unread. Returns whether anything
+    changed; nothing is written otherwise.
+
+    """
+    posts, chats = seen_counts
+    key = seen_key(game)
+    seen = player.seen.get(key, {})
+    if seen.get('chats') == chats and \
+            seen.get('posts', {}).get(str(chapter)) == posts:
+        return False
+
+    db.players.update({'_id': player._id}, {'$set': {
+        'seen.%s.chats' % key: chats,
+        'seen.%s.posts.%s' % (key, chapter): posts}})
+    return True
+
+
+def mark_own(db, pid, game, chapter=None):
+    """Counts a player's own chat message, or public post, as seen.
+
+    Only that one message is marked, so anything else unread stays so.
+
+    """
+    key = seen_key(game)
+    field = 'seen.%s.posts.%s' % (key, chapter) if chapter else \
+        'seen.%s.chats' % key
+    db.players.update({'_id': pid}, {'$inc': {field: 1}})
+
+
+def unread(player, campaigns):
+    """Counts what `player` hasn't seen in campaigns_with_chapters().
+
+    Returns a dict of unread posts by chapter id, and of unread posts
+    and chats by game, from the records alone.
+
+    """
+    counts = {}
+    for campaign in campaigns:
+        seen = player.seen.get(seen_key(campaign._id), {})
+        total = max(campaign.chat_count - seen.get('chats', 0), 0)
+        for chapter in campaign.chapters:
+            counts[chapter._id] = max(chapter.post_count -
+                seen.get('posts', {}).get(str(chapter._id), 0), 0)
+            total += counts[chapter._id]
+        counts[campaign._id] = total
+
+    return counts
+
+
+def recount(db):
+    """Rebuilds every chapter's and campaign's counters from scratch.
+
+    For data written before the counters existed; posts and chats
+    stored while this runs may be missed, so run it between deploys.
+    Returns the number of campaigns updated.
+
+    """
+    public = {'$in': [None, []]}
+    campaigns = {}
+    for chapter in db.chapters.find(fields=['game']):
+        query = {'chapter': chapter['_id'], 'players': public}
+        update = {'post_count': db.posts.find(query).count()}
+        last = list(db.posts.find(query, fields=['posted', 'source']).sort(
+            'posted', DESCENDING).limit(1))
+        if last:
+            update.update(last_post=last[0]['posted'],
+                last_poster=last[0]['source'])
+        db.chapters.update({'_id': chapter['_id']}, {'$set': update})
+
+        total = campaigns.setdefault(chapter['game'], {'post_count': 0})
+        total['post_count'] += update['post_count']
+        if last and (total.get('last_post') is None or
+                last[0]['posted'] > total['last_post']):
+            total.update(last_post=last[0]['posted'],
+                last_poster=last[0]['source'])
+
+    updated = 0
+    for campaign in db.campaigns.find(fields=['_id']):
+        update = campaigns.get(campaign['_id'], {'post_count': 0})
+        update['chat_count'] = db.chats.find(
+            {'game': campaign['_id']}).count()
+        last = newest_chat(db, campaign['_id'])
+        if last:
+            update['last_chat'] = last[0]
+        db.campaigns.update({'_id': campaign['_id']}, {'$set': update})
+        updated += 1
+
+    return updated
+
+
+##
+def main(argv=None):
+    """Rebuilds the activity counters from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=['recount'])
+    parser.add_argument('--database', default='dmxm')
+    args = parser.parse_args(argv)
+
+    print('%d campaigns recounted' % recount(dmxm.db.handle(args.database)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Random number streams for the DM Ex Machina dice roller.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+import binascii
+import os
+import random
+import threading
+
+##
+# How many batches a stream rolls before mixing in fresh entropy.
+RESEED_EVERY = 1000
+
+
+##
+class EntropyPool(object):
+    """Hands out seeds cut from a buffer of OS entropy.
+
+    Reading os.urandom in large chunks keeps the cost of seeding new
+    streams off the request path. The buffer is thrown away after a
+    fork so that worker processes never share seed material.
+
+    """
+
+    def __init__(self, chunk=4096):
+        self.chunk = chunk
+        self._buf = ''
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def take(self, size=32):
+        """Returns a seed built from `size` bytes of entropy."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._buf = ''
+                self._pid = os.getpid()
+            if len(self._buf) < size:
+                self._buf += os.urandom(max(self.chunk, size))
+            out, self._buf = self._buf[:size], self._buf[size:]
+
+        return int(binascii.hexlify(out), 16)
+
+
+ENTROPY = EntropyPool()
+
+
+class Stream(random.Random):
+    """A long-lived generator that dice can be rolled against.
+
+    Streams are seeded once from the entropy pool and reseeded every
+    RESEED_EVERY batches. Passing `seed` gives a deterministic stream
+    for replays and tests that is never reseeded.
+
+    """
+
+    def __init__(self, seed=None):
+        self.deterministic = seed is not None
+        self.batches = 0
+        random.Random.__init__(self, seed if self.deterministic
+            else ENTROPY.take())
+
+    def tick(self):
+        """Counts a rolled batch, reseeding when one is due."""
+        self.batches += 1
+        if not self.deterministic and self.batches >= RESEED_EVERY:
+            self.seed(ENTROPY.take())
+            self.batches = 0
+
+
+##
+_streams = {}
+_streams_pid = os.getpid()
+_streams_lock = threading.Lock()
+
+
+def stream(name=None):
+    """Returns the stream for `name`, or the process-wide stream.
+
+    Campaigns pass their game id so that each one rolls on its own
+    stream. Streams are dropped after a fork and recreated lazily.
+
+    """
+    global _streams_pid
+
+    with _streams_lock:
+        if _streams_pid != os.getpid():
+            _streams.clear()
+            _streams_pid = os.getpid()
+        if name not in _streams:
+            _streams[name] = Stream()
+        return _streams[name]
@@ -3,4 +3,52 @@ $(document).ready(function(){
 	var useheight = $(window).height() - 42;
 	$('.ingame').height(useheight).prop({scrollTop: $('.ingame').prop('scrollHeight')});
 	$('#post-chat').height(useheight).prop({scrollTop: $('#post-chat').prop('scrollHeight')});
-});
\ No newline at end of file
+
+	function appendPost(post) {
+		if (document.getElementById(post.id)) return;
+
+		var article = $('<article class="chapter-post"></article>').attr('id', post.id);
+		if (post.source == 'dm') {
+			article.addClass('dm-post');
+		} else {
+			article.append($('<p></p>').append($('<strong></strong>').text(post.source), '<br>', post.posted));
+		}
+		if (post['private']) article.addClass('player-specific');
+
+		$('#chapter-posts').append(article.append(post.html));
+		$('.ingame').prop({scrollTop: $('.ingame').prop('scrollHeight')});
+	}
+
+	function appendChat(chat) {
+		if (document.getElementById('chat-' + chat.id)) return;
+
+		var msg = $('<div class="msg"></div>').attr('id', 'chat-' + chat.id).append(
+			$('<p class="chatdate"></p>').text(chat.posted),
+			$('<p class="source"></p>').text(chat.source),
+			chat.html);
+
+		$('#post-chat .chats form').before(msg);
+		$('#post-chat').prop({scrollTop: $('#post-chat').prop('scrollHeight')});
+	}
+
+	// Fetch only what is newer than the last thing we have.
+	function poll(url, after, append) {
+		$.getJSON(url, after ? {after: after} : {}, function(data) {
+			$.each(data.items, function(i, item) { append(item); });
+			after = data.cursor || after;
+		}).complete(function() {
+			setTimeout(function() { poll(url, after, append); }, 10000);
+		});
+	}
+
+	// Follow new posts and chat without reloading the page.
+	var posts = $('#chapter-posts');
+	if (posts.data('stream') && window.EventSource) {
+		var source = new EventSource(posts.data('stream'));
+		source.addEventListener('post', function(e) { appendPost(JSON.parse(e.data)); }, false);
+		source.addEventListener('chat', function(e) { appendChat(JSON.parse(e.data)); }, false);
+	} else if (posts.data('stream')) {
+		poll(posts.data('posts'), posts.data('posts-after'), appendPost);
+		poll(posts.data('chats'), posts.data('chats-after'), appendChat);
+	}
+});
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Generates synthetic campaigns in MongoDB for DM Ex Machina load tests.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import db, dice, render, repository, rng
+from datetime import datetime, timedelta
+from hashlib import sha256
+import argparse
+import random
+import sys
+
+##
+# Every synthetic player signs in with this.
+PASSWORD = 'synthetic'
+
+WORDS = ('the goblin swings wildly at Vlad who ducks and counters with a '
+    'brutal strike while the torchlight flickers across ancient stone '
+    'walls and somewhere below something large stirs').split()
+
+
+##
+def sentence(chooser, words=12):
+    return ' '.join(chooser.choice(WORDS) for i in xrange(words)).capitalize()
+
+
+def body(chooser):
+    """A post body with some Markdown and, often, a few dice rolls."""
+    parts = [sentence(chooser, chooser.randint(6, 30)) + '.']
+    if chooser.random() < 0.5:
+        parts.append('**%s**' % sentence(chooser, 3))
+    for i in xrange(chooser.choice([0, 0, 1, 2, 4])):
+        parts.append('Attack %dd%d+%d' % (chooser.randint(1, 4),
+            chooser.choice([4, 6, 8, 10, 12, 20]), chooser.randint(0, 6)))
+    return '\n\n'.join(parts)
+
+
+def _bulk(collection, docs, batch=1000):
+    for start in xrange(0, len(docs), batch):
+        collection.insert(docs[start:start + batch])
+
+
+def generate(database, campaigns=3, players=6, chapters=5, posts=2000,
+        chats=5000, private=0.1, seed=1):
+    """Fills `database` with synthetic campaigns and returns a summary.
+
+    Each campaign has one DM and every player, `chapters` chapters with
+    `posts` posts each (a `private` fraction of them addressed to one
+    player) and `chats` chat messages. Bodies are rolled and rendered
+    the way the write paths do it.
+
+    """
+    chooser = random.Random(seed)
+    stream = rng.Stream(seed)
+    start = datetime.utcnow() - timedelta(days=365)
+    password = sha256(PASSWORD).hexdigest()
+
+    pids = ['player%d@synthetic.dmexmachina.com' % i
+        for i in xrange(players)]
+    games = ['synthetic%d' % i for i in xrange(campaigns)]
+
+    for pid in pids:
+        database.players.insert({'_id': pid, 'password': password,
+            'games': games, 'synthetic': True})
+
+    for n, game in enumerate(games):
+        dm = pids[n % len(pids)]
+        database.campaigns.insert({'_id': game, 'name': 'Synthetic %d' % n,
+            'started': start, 'dms': [dm], 'synthetic': True})
+
+        for c in xrange(chapters):
+            chapter = database.chapters.insert({'name': 'Chapter %d' % c,
+                'game': game, 'started': start + timedelta(days=c),
+                'players': pids, 'synthetic': True})
+
+            docs = []
+            for p in xrange(posts):
+                source = chooser.choice(pids)
+                doc = render.rendered({'chapter': chapter,
+                    'body': dice.process(body(chooser), stream),
+                    'posted': start + timedelta(days=c, seconds=p * 60),
+                    'source': 'dm' if source == dm else source})
+                if chooser.random() < private:
+                    doc['players'] = [chooser.choice(pids)]
+                docs.append(doc)
+            _bulk(database.posts, docs)
+
+        _bulk(database.chats, [render.rendered({'game': game,
+            'body': sentence(chooser, chooser.randint(2, 15)),
+            'source': chooser.choice(pids),
+            'posted': start + timedelta(seconds=i * 300)})
+            for i in xrange(chats)])
+
+    repository.recount(database)
+
+    return {'players': pids, 'campaigns': games, 'password': PASSWORD,
+        'posts': campaigns * chapters * posts, 'chats': campaigns * chats}
+
+
+def main(argv=None):
+    """Generates a dataset from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', default='dmxm-load')
+    parser.add_argument('--campaigns', type=int, default=3)
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--chapters', type=int, default=5)
+    parser.add_argument('--posts', type=int, default=2000,
+        help='posts per chapter')
+    parser.add_argument('--chats', type=int, default=5000,
+        help='chat messages per campaign')
+    parser.add_argument('--private', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--drop', action='store_true',
+        help='empty the database first')
+    args = parser.parse_args(argv)
+
+    if args.database == 'dmxm':
+        parser.error('refusing to fill the production database')
+
+    database = db.handle(args.database)
+    if args.drop:
+        db.client().drop_database(args.database)
+
+    summary = generate(database, args.campaigns, args.players,
+        args.chapters, args.posts, args.chats, args.private, args.seed)
+    print('%(posts)d posts and %(chats)d chats for %(players)s' % dict(
+        summary, players=', '.join(summary['players'])))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
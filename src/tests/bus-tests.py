@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Tests for the cache invalidation bus; needs a local mongod.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from bson.objectid import ObjectId
+from dmxm import bus, db
+
+
+##
+class DMXMBusTests(TestCase):
+
+    def setUp(self):
+        self.db = db.handle('dmxm-tests')
+        self.db.drop_collection(bus.COLLECTION)
+        bus.CREATED.clear()
+        self.seen = []
+        bus.HANDLERS['test'] = [self.seen.append]
+
+    def tearDown(self):
+        del bus.HANDLERS['test']
+        self.db.drop_collection(bus.COLLECTION)
+        bus.CREATED.clear()
+
+    def test_publish_local(self):
+        """The publishing worker evicts its own entries straight away."""
+        bus.publish(self.db, 'test', 'testsession')
+        self.assertEqual(self.seen, ['testsession'])
+
+    def test_other_workers(self):
+        """Other workers see events through the capped collection."""
+        listener = bus.Listener('dmxm-tests')
+        bus.events(self.db).insert({'kind': 'test', 'key': 'player'})
+        bus.events(self.db).insert({'kind': 'other', 'key': 'ignored'})
+
+        listener.drain()
+        self.assertEqual(self.seen, ['player'])
+
+        listener.drain()
+        self.assertEqual(self.seen, ['player'])
+
+    def test_out_of_order_ids(self):
+        """Events are resumed in insertion order, not by ObjectId."""
+        listener = bus.Listener('dmxm-tests')
+        earlier = ObjectId()
+        later = ObjectId()
+        bus.events(self.db).insert({'_id': later, 'kind': 'test',
+            'key': 'first'})
+        listener.drain()
+        bus.events(self.db).insert({'_id': earlier, 'kind': 'test',
+            'key': 'second'})
+        listener.drain()
+        self.assertEqual(self.seen, ['first', 'second'])
+
+    def test_failing_handler(self):
+        """A handler that raises doesn't stop the ones after it."""
+        def broken(key):
+            raise ValueError(key)
+        bus.HANDLERS['test'].insert(0, broken)
+
+        listener = bus.Listener('dmxm-tests')
+        bus.events(self.db).insert({'kind': 'test', 'key': 'player'})
+        listener.drain()
+        self.assertEqual(self.seen, ['player'])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the in-process caches.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from dmxm import cache
+import time
+
+
+##
+class DMXMCacheTests(TestCase):
+    """Tests for the LRU/TTL cache."""
+
+    def test_lru_eviction(self):
+        """The least recently used entry goes first."""
+        lru = cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('c'), 3)
+
+    def test_ttl_expiry(self):
+        """Entries expire once their TTL has passed."""
+        lru = cache.LRUCache(2, ttl=0.01)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+
+        time.sleep(0.02)
+        self.assertNotIn('a', lru)
+        self.assertEqual(lru.get('a'), None)
+
+    def test_disabled(self):
+        """A cache with no room never holds anything."""
+        lru = cache.LRUCache(0)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), None)
+
+    def test_invalidate(self):
+        """Written documents can be dropped explicitly."""
+        lru = cache.LRUCache(2)
+        lru.set('a', 1)
+        lru.invalidate('a')
+        self.assertEqual(lru.get('a'), None)
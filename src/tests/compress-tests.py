@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the response compression middleware.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from dmxm import compress
+import zlib
+
+
+##
+def app(body, ctype='text/html', length=True):
+    """A WSGI app that serves `body` as a list of chunks."""
+    def application(environ, start_response):
+        headers = [('Content-Type', ctype)]
+        if length:
+            headers.append(('Content-Length', str(len(''.join(body)))))
+        start_response('200 OK', headers)
+        return body
+    return application
+
+
+def tagged(body, etag):
+    """A WSGI app that serves `body` with an ETag, or a 304 if matched."""
+    def application(environ, start_response):
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 NOT MODIFIED', [('ETag', etag)])
+            return []
+        start_response('200 OK', [('Content-Type', 'text/html'),
+            ('Content-Length', str(len(''.join(body)))), ('ETag', etag)])
+        return body
+    return application
+
+
+def call(application, encoding='gzip', **environ):
+    """Runs a request and returns (headers, chunks)."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['headers'] = dict(headers)
+
+    environ['HTTP_ACCEPT_ENCODING'] = encoding
+    chunks = list(application(environ, start_response))
+    return response['headers'], chunks
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+##
+class DMXMCompressTests(TestCase):
+    """Tests for the Compressor middleware."""
+
+    def test_gzip_html(self):
+        """Large HTML pages are gzipped for browsers that accept it."""
+        page = ['<p>Hello there.</p>' * 200]
+        headers, chunks = call(compress.Compressor(app(page)))
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(gunzip(''.join(chunks)), page[0])
+
+    def test_small_response(self):
+        """Responses under the threshold aren't worth compressing."""
+        headers, chunks = call(compress.Compressor(app(['tiny'])))
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(chunks, ['tiny'])
+
+    def test_not_accepted(self):
+        """Clients that don't ask for compression don't get it."""
+        page = ['x' * 2000]
+        headers, chunks = call(compress.Compressor(app(page)), '')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+    def test_images_untouched(self):
+        """Binary types pass straight through."""
+        headers, chunks = call(compress.Compressor(
+            app(['x' * 2000], 'image/png')))
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertNotIn('Vary', headers)
+
+    def test_streamed(self):
+        """Streamed responses are flushed chunk by chunk."""
+        events = ['data: %d\n\n' % i for i in range(3)]
+        headers, chunks = call(compress.Compressor(
+            app(events, 'text/event-stream', length=False)))
+
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(chunks[0]), events[0])
+        self.assertEqual(gunzip(''.join(chunks)), ''.join(events))
+
+    def test_etag_tagged(self):
+        """Encoded responses don't reuse the app's strong ETag."""
+        page = ['<p>Hello there.</p>' * 200]
+        application = compress.Compressor(tagged(page, '"abc"'))
+
+        headers, chunks = call(application)
+        self.assertEqual(headers['ETag'], '"abc-gzip"')
+
+        headers, chunks = call(application, '')
+        self.assertEqual(headers['ETag'], '"abc"')
+
+    def test_etag_revalidated(self):
+        """A tagged ETag still gets a 304 from the app."""
+        page = ['<p>Hello there.</p>' * 200]
+        application = compress.Compressor(tagged(page, '"abc"'))
+
+        headers, chunks = call(application,
+            HTTP_IF_NONE_MATCH='"abc-gzip"')
+        self.assertEqual(headers['ETag'], '"abc-gzip"')
+        self.assertNotIn('Content-Type', headers)
+        self.assertEqual(chunks, [])
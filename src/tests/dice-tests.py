@@ -30,7 +30,7 @@ For more information, please refer to <http://unlicense.org/>
 """
 ##
 from unittest import TestCase
-from dmxm import dice
+from dmxm import dice, rng
 
 
 ##
@@ -93,3 +93,37 @@ class DMXMDiceTests(TestCase):
         roll = dice.roll(dres)
         # The 'Brutal 2' should prevent anything less than 8.
         self.assertEqual(True, (roll >= 8))
+
+    def test_dice_process(self):
+        """Every roll in a post is replaced, in order, in one pass."""
+        post = 'Attack 1d1+3, damage 2d1+4, then d1b0 and 3d1.'
+        self.assertEqual(dice.process(post),
+            'Attack 4, damage 6, then 1 and 3.')
+
+    def test_dice_process_nodice(self):
+        """Posts without rolls come back untouched."""
+        post = 'This is a test post with no die rolls.'
+        self.assertEqual(dice.process(post), post)
+
+    def test_dice_brutal_range(self):
+        """Brutal dice never come up at or under the brutal value."""
+        rolls = dice.roll_many([(50, 6, 0, 4)] * 20)
+        for each in rolls:
+            self.assertEqual(True, (250 <= each <= 300))
+
+    def test_dice_impossible(self):
+        """Rolls that can never finish are rejected up front."""
+        self.assertRaises(ValueError, dice.roll, (1, 6, 0, 6))
+        self.assertRaises(ValueError, dice.roll, (1, 0, 0, 0))
+        self.assertEqual(dice.process('Hit for 1d4b9'), 'Hit for 1d4b9')
+
+    def test_dice_seeded_stream(self):
+        """Seeded streams replay exactly the same rolls."""
+        post = 'Attack 1d20+3, damage 4d8+4b2'
+        first = dice.process(post, rng.Stream(1234))
+        self.assertEqual(first, dice.process(post, rng.Stream(1234)))
+
+    def test_dice_game_streams(self):
+        """Each campaign keeps its own long-lived stream."""
+        self.assertIs(rng.stream('testsession'), rng.stream('testsession'))
+        self.assertIsNot(rng.stream('testsession'), rng.stream())
@@ -29,11 +29,12 @@ For more information, please refer to <http://unlicense.org/>
 
 """
 ##
-from dmxm import webclient
+from dmxm import bus, profiler, render, repository, webclient
 from unittest import TestCase
 from pymongo import Connection
 from hashlib import sha256
 from datetime import datetime
+import json
 
 
 ##
@@ -83,6 +84,10 @@ class DMXMAppUnitTests(TestCase):
         self.db.chapters.remove()
         self.db.chats.remove()
 
+        # Cached metadata would outlive the documents between tests.
+        repository.CAMPAIGNS.clear()
+        repository.CHAPTERS.clear()
+
     def test_homepage_login_form(self):
         """Anonymous users should see a login screen."""
         rv = self.app.get('/')
@@ -168,6 +173,98 @@ class DMXMAppUnitTests(TestCase):
 
         self.assertIn('Hello there.', rv.data)
 
+    def test_chapterpage_paginated(self):
+        """Long chapters show the latest posts and link to older ones."""
+        self.login()
+        webclient.POSTS_PAGE = 1
+
+        try:
+            rv = self.app.get('/games/testsession/chapter/%s' % self.chapter)
+            self.assertIn('Hello there', rv.data)
+            self.assertNotIn('test post', rv.data)
+            self.assertIn('posts_before=', rv.data)
+
+            older = rv.data.split('posts_before=')[1].split('"')[0]
+            rv = self.app.get('/games/testsession/chapter/%s?posts_before=%s'
+                % (self.chapter, older))
+            self.assertIn('test post', rv.data)
+            self.assertNotIn('posts_before=', rv.data)
+        finally:
+            webclient.POSTS_PAGE = 50
+
+    def test_chapterpage_not_modified(self):
+        """Reloading an unchanged chapter gets a 304 until someone posts."""
+        self.login()
+
+        uri = '/games/testsession/chapter/%s' % self.chapter
+        rv = self.app.get(uri)
+        etag = rv.headers['ETag']
+
+        rv = self.app.get(uri, headers={'If-None-Match': etag})
+        self.assertEqual(rv.status_code, 304)
+
+        self.app.post('/games/testsession/chat', data={'post-text': 'New!'})
+        rv = self.app.get(uri, headers={'If-None-Match': etag})
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('New!', rv.data)
+
+    def test_chapterpage_modified_since(self):
+        """A date alone never gets a 304; it can't name the viewer."""
+        self.login()
+
+        uri = '/games/testsession/chapter/%s' % self.chapter
+        rv = self.app.get(uri)
+        since = rv.headers['Last-Modified']
+
+        rv = self.app.get(uri, headers={'If-Modified-Since': since})
+        self.assertEqual(rv.status_code, 200)
+        self.assertIn('Hello there', rv.data)
+
+    def test_chapterpage_private_posts(self):
+        """Players only get the private posts addressed to them."""
+        self.login()
+        self.db.campaigns.update({'_id': 'testsession'},
+            {'$set': {'dms': []}})
+        bus.publish(self.db, 'campaign', 'testsession')
+
+        self.db.posts.insert({'chapter': self.chapter,
+            'posted': datetime.utcnow(), 'source': 'dm',
+            'players': ['test@dmexmachina.com'], 'body': 'For your eyes.'})
+        self.db.posts.insert({'chapter': self.chapter,
+            'posted': datetime.utcnow(), 'source': 'dm',
+            'players': ['someone@dmexmachina.com'], 'body': 'Not for you.'})
+
+        rv = self.app.get('/games/testsession/chapter/%s' % self.chapter)
+        self.assertIn('For your eyes.', rv.data)
+        self.assertNotIn('Not for you.', rv.data)
+        self.assertIn('test post', rv.data)
+
+    def test_api_posts_delta(self):
+        """The JSON API only returns posts newer than the cursor."""
+        self.login()
+
+        uri = '/api/games/testsession/chapter/%s/posts' % self.chapter
+        rv = self.app.get(uri)
+        self.assertIn('Hello there', rv.data)
+        cursor = json.loads(rv.data)['cursor']
+
+        rv = self.app.get('%s?after=%s' % (uri, cursor))
+        self.assertEqual(json.loads(rv.data)['items'], [])
+
+        self.app.post('/games/testsession/chapter/%s/post' % self.chapter,
+            data={'post-text': '**Fresh**'})
+        rv = self.app.get('%s?after=%s' % (uri, cursor))
+        items = json.loads(rv.data)['items']
+        self.assertEqual(len(items), 1)
+        self.assertIn('<strong>Fresh</strong>', items[0]['html'])
+
+    def test_api_chats_no_access(self):
+        """Players can't read the chat of games they are not in."""
+        self.login()
+
+        rv = self.app.get('/api/games/testsession2/chats')
+        self.assertEqual(rv.status_code, 404)
+
     def test_chapterpage_locked(self):
         """Locking a chapter should disallow players from posting."""
         self.login()
@@ -178,10 +275,17 @@ class DMXMAppUnitTests(TestCase):
         # Lock the chapter for this test.
         self.db.chapters.update({'_id': self.chapter},
             {'$set': {'locked': True}})
+        bus.publish(self.db, 'chapter', self.chapter)
 
         rv = self.app.get('/games/testsession/chapter/%s' % self.chapter)
         self.assertNotIn('testsession/post', rv.data)
 
+        # Posting to it anyway does nothing.
+        self.app.post('/games/testsession/chapter/%s/post' % self.chapter,
+            data={'post-text': 'Sneaky post.'})
+        self.assertEqual(self.db.posts.find_one({'body': 'Sneaky post.'}),
+            None)
+
     def test_chapterpost_markdown(self):
         """Posts in chapters should support Markdown syntax."""
         self.login()
@@ -191,6 +295,19 @@ class DMXMAppUnitTests(TestCase):
 
         self.assertIn('<strong>Hello there.</strong>', rv.data)
 
+    def test_chapterpost_rendered_on_write(self):
+        """Posts are rendered to HTML once, when they are written."""
+        self.login()
+
+        self.app.post('/games/testsession/chapter/%s/post' % self.chapter,
+            data={'post-text': '**Rendered** <script>'})
+
+        post = self.db.posts.find_one({'chapter': self.chapter,
+            'body': '**Rendered** <script>'})
+        self.assertIn('<strong>Rendered</strong>', post['html'])
+        self.assertNotIn('<script>', post['html'])
+        self.assertEqual(post['renderer'], render.RENDERER_VERSION)
+
     def test_chapterpage_chaptertext_highlights(self):
         """Text posted by the DM of the game should be highlighted."""
         self.login()
@@ -210,6 +327,49 @@ class DMXMAppUnitTests(TestCase):
 
         self.assertNotIn('1d20+4', rv.data)
 
+    def test_admin_metrics(self):
+        """Admins can see per-route metrics; nobody else can."""
+        rv = self.app.get('/admin/metrics')
+        self.assertEqual(rv.status_code, 302)
+
+        self.login()
+        self.app.get('/games/testsession/chapter/%s' % self.chapter)
+
+        rv = self.app.get('/admin/metrics')
+        self.assertIn('dmxm_mongo_queries_total{route="/games/<gamename>/'
+            'chapter/<chapter>"}', rv.data)
+
+    def test_admin_profile(self):
+        """Admins can profile a single request and find it listed."""
+        self.login()
+
+        rv = self.app.get('/games/testsession/chapter/%s?_profile=1'
+            % self.chapter)
+        name = rv.headers['X-DMXM-Profile']
+
+        rv = self.app.get('/admin/profiles')
+        self.assertIn('%s.folded' % name, rv.data)
+
+    def test_profile_after_error(self):
+        """A profile is still stopped and saved when the request fails."""
+        self.login()
+
+        self.app.get('/games/testsession/chapter/notanid?_profile=1')
+        self.assertIn('notanid', ' '.join(p['name']
+            for p in profiler.listing()))
+
+    def test_sampled_profile_private(self):
+        """Sampled requests don't tell the player they were profiled."""
+        self.login()
+
+        rate, profiler.SAMPLE_RATE = profiler.SAMPLE_RATE, 1.0
+        profiler._last_sample[0] = 0.0
+        try:
+            rv = self.app.get('/')
+        finally:
+            profiler.SAMPLE_RATE = rate
+        self.assertNotIn('X-DMXM-Profile', rv.headers)
+
     def test_logout(self):
         """Users should be able to logout."""
         self.login()
@@ -253,6 +413,35 @@ class DMXMAppUnitTests(TestCase):
         rv = self.app.get('/games/testsession/chapter/%s' % self.chapter)
         self.assertIn('<strong>RAWR</strong>', rv.data)
 
+    def test_dice_odds(self):
+        """DMs can ask for the exact odds of a roll."""
+        self.login()
+
+        rv = self.app.get('/dice/odds?expr=2d6&target=12')
+        self.assertIn('"mean": 7.0', rv.data)
+        self.assertIn('"at_least": 0.027', rv.data)
+
+        rv = self.app.get('/dice/odds?expr=1d4b4')
+        self.assertEqual(rv.status_code, 400)
+
+
+    def test_unread_badges(self):
+        """New posts show on the homepage until the chapter is read."""
+        self.login()
+        self.app.post('/games/testsession/chapter/%s/post' % self.chapter,
+            data={'post-text': 'My own.'})
+
+        rv = self.app.get('/')
+        self.assertNotIn('1 new', rv.data)
+
+        repository.add_post(self.db, repository.chapter(self.db,
+            self.chapter), 'someone@dmexmachina.com', 'Something new.')
+        rv = self.app.get('/')
+        self.assertIn('1 new', rv.data)
+
+        self.app.get('/games/testsession/chapter/%s' % self.chapter)
+        rv = self.app.get('/')
+        self.assertNotIn('1 new', rv.data)
 
     def login(self):
         """Performs a login as our test user."""
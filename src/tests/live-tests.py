@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Tests for live feeds of posts and chat; needs a local mongod.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from datetime import datetime, timedelta
+from dmxm import db, live, loaders
+
+
+##
+class DMXMLiveTests(TestCase):
+
+    def setUp(self):
+        self.db = db.handle('dmxm-tests')
+        self.hub = live.Hub('dmxm-tests')
+        self.topic = ('chats', 'game', 'testsession')
+        self.start = datetime.utcnow()
+
+    def tearDown(self):
+        self.db.chats.remove()
+
+    def chat(self, n):
+        """Stores chat message `n` and returns its cursor."""
+        doc = {'game': 'testsession', 'body': 'Chat %d' % n,
+            'posted': self.start + timedelta(seconds=n)}
+        self.db.chats.insert(doc, safe=True)
+        return loaders.cursor(doc)
+
+    def received(self, sub):
+        """The bodies queued for `sub` so far."""
+        bodies = []
+        while not sub.queue.empty():
+            bodies.append(sub.get(0)[1]['body'])
+        return bodies
+
+    def test_new_messages(self):
+        """Subscribers get what is posted after they join."""
+        self.chat(0)
+        sub = self.hub.subscribe([self.topic])
+        self.chat(1)
+        self.hub.poll()
+        self.assertEqual(self.received(sub), ['Chat 1'])
+
+    def test_late_join(self):
+        """A client joining a watched topic still gets its whole gap."""
+        page = self.chat(0)
+        early = self.hub.subscribe([self.topic])
+        self.chat(1)
+        self.chat(2)
+        self.hub.poll()
+        self.assertEqual(self.received(early), ['Chat 1', 'Chat 2'])
+
+        late = self.hub.subscribe([self.topic], after={self.topic: page})
+        self.hub.poll()
+        self.assertEqual(self.received(late), ['Chat 1', 'Chat 2'])
+        self.assertEqual(self.received(early), [])
+
+    def test_reconnect(self):
+        """Reconnecting from the last event id resumes after it."""
+        self.chat(0)
+        first = self.hub.subscribe([self.topic])
+        self.chat(1)
+        self.hub.poll()
+        last = loaders.cursor(first.get(0)[1])
+        self.hub.unsubscribe(first)
+
+        self.chat(2)
+        again = self.hub.subscribe([self.topic], after={self.topic: last})
+        self.hub.poll()
+        self.assertEqual(self.received(again), ['Chat 2'])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for request and query metrics.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from dmxm import metrics
+
+
+##
+class DMXMMetricsTests(TestCase):
+    """Tests for recording and exporting metrics."""
+
+    def setUp(self):
+        metrics.ROUTES.clear()
+
+    def test_request(self):
+        """Queries and timers are filed under the request's route."""
+        metrics.begin()
+        metrics.record_query('posts.find', 0.002)
+        metrics.record_query('chats.find', 0.003)
+        with metrics.timer('template'):
+            pass
+        req = metrics.end('/games/<gamename>')
+
+        self.assertEqual(len(req.queries), 2)
+        self.assertIn('posts.find 2.0ms', metrics.breakdown(req))
+
+        stats = metrics.ROUTES['/games/<gamename>']
+        self.assertEqual(stats.requests, 1)
+        self.assertEqual(stats.queries, 2)
+        self.assertIn('template', stats.timers)
+
+    def test_outside_request(self):
+        """Queries from background threads are simply not recorded."""
+        metrics.record_query('posts.find', 0.002)
+        self.assertEqual(metrics.end('/'), None)
+
+    def test_prometheus(self):
+        """The export is in the Prometheus text format."""
+        metrics.begin()
+        metrics.record_query('posts.find', 0.002)
+        metrics.end('/')
+
+        text = metrics.prometheus()
+        self.assertIn('dmxm_request_seconds_bucket{route="/",le="+Inf"} 1',
+            text)
+        self.assertIn('dmxm_request_seconds_count{route="/"} 1', text)
+        self.assertIn('dmxm_mongo_queries_total{route="/"} 1', text)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the dice probability engine.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from dmxm import probability
+import time
+
+
+##
+class DMXMProbabilityTests(TestCase):
+    """Tests for exact dice distributions."""
+
+    def test_two_dice(self):
+        """2d6 should have the familiar triangle of outcomes."""
+        dist = probability.distribution((2, 6, 0, 0))
+        self.assertEqual(dist.ways, [1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1])
+        self.assertEqual((dist.low, dist.high), (2, 12))
+        self.assertEqual(dist.mean(), 7.0)
+        self.assertEqual(dist.percentile(50), 7)
+
+    def test_brutal_addend(self):
+        """Brutal dice and addends shift the range of outcomes."""
+        dist = probability.distribution((1, 10, 5, 2))
+        self.assertEqual((dist.low, dist.high), (8, 15))
+        self.assertEqual(dist.at_least(8), 1.0)
+        self.assertEqual(dist.at_least(15), 1.0 / 8)
+
+    def test_summarize(self):
+        """Summaries answer the questions DMs ask while writing."""
+        summary = probability.summarize('40d10b2', target=300)
+        self.assertEqual(summary['mean'], 260.0)
+        self.assertEqual(summary['min'], 120)
+        self.assertEqual(summary['max'], 400)
+        self.assertEqual(True, (0 < summary['at_least'] < 0.5))
+
+    def test_summarize_not_dice(self):
+        """Text that is not a dice expression has no odds."""
+        self.assertEqual(probability.summarize('1x100'), None)
+        self.assertRaises(ValueError, probability.summarize, '1d4b4')
+
+    def test_largest_rolls_are_quick(self):
+        """The biggest rolls the odds endpoint accepts answer quickly."""
+        for expr in ('49d101', '500d2', '1d250000', '1000d6', '1000d1000'):
+            probability.DISTRIBUTIONS.clear()
+            start = time.time()
+            probability.summarize(expr, target=10)
+            self.assertTrue(time.time() - start < 0.5, expr)
+
+        self.assertRaises(ValueError, probability.summarize, '20d100000')
+        self.assertRaises(ValueError, probability.summarize, '1001d6')
+
+    def test_approximation(self):
+        """Big rolls are approximated closely enough to be useful."""
+        exact = probability.Distribution((29, 6, 0, 0))
+        approx = probability.Approximation((29, 6, 0, 0))
+        self.assertEqual(approx.mean(), exact.mean())
+        for pct in (5, 50, 95):
+            self.assertTrue(abs(approx.percentile(pct) -
+                exact.percentile(pct)) <= 1)
+        self.assertTrue(abs(approx.at_least(110) -
+            exact.at_least(110)) < 0.01)
+        self.assertEqual(probability.summarize('1000d6')['exact'], False)
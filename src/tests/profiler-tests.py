@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Tests for request profiling in DM Ex Machina.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from dmxm import profiler
+import shutil
+import tempfile
+
+
+##
+class DMXMProfilerTests(TestCase):
+
+    def setUp(self):
+        self.dir, profiler.PROFILE_DIR = profiler.PROFILE_DIR, \
+            tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(profiler.PROFILE_DIR)
+        profiler.PROFILE_DIR = self.dir
+
+    def profile(self, label):
+        profile = profiler.Profile()
+        profile.start()
+        return profile.stop(label)
+
+    def test_unique_names(self):
+        """Two profiles of one path in the same second don't collide."""
+        first = self.profile('/games/testsession')
+        second = self.profile('/games/testsession')
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(profiler.listing()), 2)
+
+    def test_pruned(self):
+        """Only the newest MAX_PROFILES profiles are kept."""
+        keep, profiler.MAX_PROFILES = profiler.MAX_PROFILES, 3
+        try:
+            for i in range(5):
+                self.profile('/')
+        finally:
+            profiler.MAX_PROFILES = keep
+        self.assertEqual(len(profiler.listing()), 3)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Tests for typed data access; needs a local mongod.
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from datetime import datetime
+from hashlib import sha256
+from dmxm import db, repository
+
+
+##
+class DMXMRepositoryTests(TestCase):
+
+    def setUp(self):
+        self.db = db.handle('dmxm-tests')
+        self.db.players.insert({'_id': 'test@dmexmachina.com',
+            'password': sha256('test').hexdigest(), 'games': ['testsession'],
+            'email': 'test@dmexmachina.com'}, safe=True)
+        self.db.campaigns.insert({'_id': 'testsession', 'name': 'Test',
+            'started': datetime.utcnow(), 'dms': []}, safe=True)
+        self.chapter = repository.Chapter({'_id': self.db.chapters.insert(
+            {'name': 'ENCOUNTER IX', 'game': 'testsession'}, safe=True),
+            'game': 'testsession'})
+
+    def tearDown(self):
+        self.db.players.remove()
+        self.db.posts.remove()
+        self.db.chats.remove()
+        self.db.campaigns.remove()
+        self.db.chapters.remove()
+        repository.PLAYERS.clear()
+        repository.CAMPAIGNS.clear()
+        repository.CHAPTERS.clear()
+
+    def test_player_projection(self):
+        """Players are loaded without their password hash."""
+        user = repository.player(self.db, 'test@dmexmachina.com')
+        self.assertEqual(user.games, ['testsession'])
+        self.assertFalse(user.admin)
+        self.assertFalse(hasattr(user, 'password'))
+        self.assertFalse(hasattr(user, 'email'))
+
+    def test_check_password(self):
+        """Passwords are checked in the query, not in Python."""
+        self.assertTrue(repository.check_password(self.db,
+            'test@dmexmachina.com', 'test'))
+        self.assertFalse(repository.check_password(self.db,
+            'test@dmexmachina.com', 'wrong'))
+
+    def test_records_have_slots(self):
+        """Records only hold the fields they declare."""
+        post = repository.Post({'_id': 1, 'source': 'dm', 'body': '*Hi*',
+            'posted': datetime.utcnow(), 'chapter': 2})
+        self.assertIn('<em>Hi</em>', post.html)
+        self.assertEqual(post.players, None)
+        self.assertRaises(AttributeError, setattr, post, 'chapter', 2)
+
+    def test_posts_projection(self):
+        """Pages of posts leave the stored bodies behind."""
+        post = repository.add_post(self.db, self.chapter, 'dm', '**Loud**')
+        posts, older = repository.posts(self.db, self.chapter._id, 'someone')
+        self.assertEqual([p._id for p in posts], [post['_id']])
+        self.assertIn('<strong>Loud</strong>', posts[0].html)
+        self.assertEqual(older, None)
+
+    def test_post_counters(self):
+        """Public posts bump the chapter and campaign counters."""
+        repository.add_post(self.db, self.chapter, 'dm', 'One.')
+        repository.add_post(self.db, self.chapter, 'dm', 'Secret.',
+            ['test@dmexmachina.com'])
+        repository.add_post(self.db, self.chapter, 'test@dmexmachina.com',
+            'Two.')
+
+        chapter = repository.chapter(self.db, self.chapter._id)
+        self.assertEqual(chapter.post_count, 2)
+        self.assertEqual(chapter.last_poster, 'test@dmexmachina.com')
+
+        campaign = repository.campaign(self.db, 'testsession')
+        self.assertEqual(campaign.post_count, 2)
+        self.assertEqual(campaign.last_post, chapter.last_post)
+
+    def test_chat_counters(self):
+        """A write-behind batch updates each game's counter once."""
+        chats = [repository.new_chat('testsession', 'dm', 'Hi %d' % n)
+            for n in xrange(3)]
+        self.db.chats.insert(chats)
+        repository.chats_added(self.db, chats)
+
+        doc = self.db.campaigns.find_one({'_id': 'testsession'})
+        self.assertEqual(doc['chat_count'], 3)
+        self.assertEqual(doc['last_chat'], chats[-1]['posted'])
+
+    def test_unread(self):
+        """Unread badges come from the counters and seen markers."""
+        for n in xrange(3):
+            repository.add_post(self.db, self.chapter, 'dm', 'Post.')
+        repository.add_chat(self.db,
+            repository.new_chat('testsession', 'dm', 'Hi'))
+
+        def load():
+            user = repository.player(self.db, 'test@dmexmachina.com')
+            return user, repository.campaigns_with_chapters(self.db,
+                'test@dmexmachina.com', ['testsession'])
+
+        self.db.chapters.update({}, {'$set': {
+            'players': ['test@dmexmachina.com']}})
+        user, sessions = load()
+        unread = repository.unread(user, sessions)
+        self.assertEqual(unread[self.chapter._id], 3)
+        self.assertEqual(unread['testsession'], 4)
+
+        seen_counts = repository.counts(self.db, 'testsession',
+            self.chapter._id)
+        self.assertTrue(repository.mark_seen(self.db, user, 'testsession',
+            self.chapter._id, seen_counts))
+        user, sessions = load()
+        self.assertFalse(repository.mark_seen(self.db, user, 'testsession',
+            self.chapter._id, seen_counts))
+        self.assertEqual(repository.unread(user, sessions)['testsession'], 0)
+
+        # Your own messages don't count; other players' still do.
+        repository.add_chat(self.db,
+            repository.new_chat('testsession', 'dm', 'Mine'))
+        repository.mark_own(self.db, 'test@dmexmachina.com', 'testsession')
+        repository.add_chat(self.db,
+            repository.new_chat('testsession', 'someone', 'Theirs'))
+        user, sessions = load()
+        self.assertEqual(repository.unread(user, sessions)['testsession'], 1)
+
+        # Posts arriving while the page loads aren't marked seen.
+        seen_counts = repository.counts(self.db, 'testsession',
+            self.chapter._id)
+        repository.add_post(self.db, self.chapter, 'dm', 'Meanwhile.')
+        repository.mark_seen(self.db, user, 'testsession', self.chapter._id,
+            seen_counts)
+        user, sessions = load()
+        self.assertEqual(repository.unread(user, sessions)['testsession'], 1)
+
+    def test_seen_keys(self):
+        """Game names that Mongo field paths choke on are stored safely."""
+        user = repository.player(self.db, 'test@dmexmachina.com')
+        repository.mark_seen(self.db, user, '$odd.game', self.chapter._id,
+            repository.counts(self.db, '$odd.game', self.chapter._id))
+        key = repository.seen_key('$odd.game')
+        self.assertNotIn('.', key)
+        self.assertFalse(key.startswith('$'))
+
+        doc = self.db.players.find_one({'_id': 'test@dmexmachina.com'})
+        self.assertEqual(doc['seen'][key]['chats'], 0)
+
+    def test_recount(self):
+        """Counters can be rebuilt for existing posts and chats."""
+        self.db.posts.insert([{'chapter': self.chapter._id, 'source': 'dm',
+            'posted': datetime.utcnow(), 'body': 'Old.'} for n in xrange(2)])
+        self.db.chats.insert({'game': 'testsession', 'source': 'dm',
+            'posted': datetime.utcnow(), 'body': 'Old.'})
+
+        self.assertEqual(repository.recount(self.db), 1)
+        doc = self.db.campaigns.find_one({'_id': 'testsession'})
+        self.assertEqual((doc['post_count'], doc['chat_count']), (2, 1))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Tests for write-behind inserts; needs a local mongod.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from unittest import TestCase
+from pymongo.errors import AutoReconnect
+from dmxm import db, writebehind
+import time
+
+
+##
+class DMXMWriteBehindTests(TestCase):
+
+    def setUp(self):
+        """Queues are left unstarted so that nothing flushes on its own."""
+        self.db = db.handle('dmxm-tests')
+        self.db.drop_collection('writebehind')
+        self.batches = []
+        self.queue = writebehind.WriteBehind('dmxm-tests', 'writebehind',
+            maxsize=5, batch=3, interval=60, timeout=0,
+            flushed=self.batches.append)
+
+    def tearDown(self):
+        self.queue.drain()
+        self.db.drop_collection('writebehind')
+
+    def test_drain(self):
+        """Queued documents are written in batches when drained."""
+        for i in range(4):
+            self.queue.put({'n': i})
+        self.queue.drain()
+
+        self.assertEqual(self.db.writebehind.count(), 4)
+        self.assertEqual([len(b) for b in self.batches], [3, 1])
+        self.assertEqual(self.queue.metrics()['depth'], 0)
+
+    def test_backpressure(self):
+        """A full queue makes the caller write the document itself."""
+        for i in range(6):
+            self.queue.put({'n': i})
+
+        self.assertEqual(self.queue.metrics()['overflows'], 1)
+        self.assertEqual(self.db.writebehind.count(), 1)
+
+    def test_failed_insert_retried(self):
+        """A batch whose insert fails once is retried, not lost."""
+        collection = self.db.writebehind
+        failures = [AutoReconnect('mongod went away')]
+
+        class Flaky(object):
+            def __getitem__(self, name):
+                return self
+
+            def insert(self, docs, **kwargs):
+                if failures:
+                    raise failures.pop()
+                return collection.insert(docs, **kwargs)
+
+        handle = writebehind.db.handle
+        writebehind.db.handle = lambda database: Flaky()
+        try:
+            self.queue.interval = 0
+            for i in range(3):
+                self.queue.put({'n': i})
+            self.queue.drain()
+        finally:
+            writebehind.db.handle = handle
+
+        self.assertEqual(self.db.writebehind.count(), 3)
+        self.assertEqual(self.queue.metrics()['failures'], 1)
+        self.assertEqual(self.queue.metrics()['dropped'], 0)
+
+    def test_callback_errors(self):
+        """A failing callback doesn't stop the flushing thread."""
+        def flushed(docs):
+            raise ValueError('bad callback')
+
+        queue = writebehind.WriteBehind('dmxm-tests', 'writebehind',
+            batch=2, interval=0.01, flushed=flushed)
+        queue.start()
+        for i in range(4):
+            queue.put({'n': i})
+            time.sleep(0.05)
+
+        self.assertTrue(queue._thread.is_alive())
+        queue.drain()
+        self.assertEqual(self.db.writebehind.count(), 4)
+        self.assertEqual(queue.metrics()['callback_errors'],
+            queue.metrics()['flushes'])
@@ -30,17 +30,24 @@ For more information, please refer to <http://unlicense.org/>
 
 """
 ##
-from flask import Flask, flash, g, render_template, request, redirect, session
-from pymongo import Connection, DESCENDING, ASCENDING
+from flask import Flask, flash, g, jsonify, make_response, request, \
+    redirect, send_from_directory, session
+import flask
+from pymongo.errors import AutoReconnect
 from bson.objectid import ObjectId
 from hashlib import sha256
-from datetime import datetime
 from flaskext.markdown import Markdown
 from flask.ext.assets import Environment, Bundle
 from functools import wraps
-from dmxm import dice
+from werkzeug.urls import url_encode
+from dmxm import bundles, bus, db, dice, live, loaders, metrics, \
+    probability, profiler, render, repository, rng, writebehind
+import json
+import mimetypes
+import os
 import re
 import pytz
+import threading
 
 
 ##
@@ -48,6 +55,21 @@ APP = Flask(__name__)
 Markdown(APP)
 assets = Environment(APP)
 DATABASE = 'dmxm'
+
+# How many chapter posts and chat messages to show on a page.
+POSTS_PAGE = 50
+CHATS_PAGE = 50
+
+# Seconds between keepalives on an idle live feed.
+KEEPALIVE = 15
+# Requests slower than this many seconds are logged with their queries.
+SLOW_REQUEST = 1.0
+
+# Set to True to queue chat messages and insert them in batches.
+CHAT_WRITE_BEHIND = False
+_chat_queue = None
+_chat_queue_lock = threading.Lock()
+
 APP.secret_key = '\xf6w\x9c.\xe6;>{\x931\x0cp\xa7g\xc6\x15'
 
 
@@ -61,34 +83,204 @@ css = Bundle('reset.css', 'style.css', filters='cssmin', output='packed.css')
 assets.register('css_all', css)
 
 
+# Keep every worker's caches in step with writes made by the others.
+# New posts and chats are published as 'posts' (by chapter) and
+# 'chats' (by game) for caches of rendered pages to listen for.
+bus.on('player', repository.forget_player)
+bus.on('campaign', repository.forget_campaign)
+bus.on('chapter', repository.forget_chapter)
+
+
 ##
 @APP.context_processor
 def inject_user_info():
     """Insert user info into all templates."""
     if 'pid' in session:
-        g.user = g.db.players.find_one({'_id': session['pid']})
-        return {'user': g.user}
+        return {'user': current_user()}
     else:
         return {}
 
 
 @APP.before_request
 def request_database():
-    """Each page request gets a connection to MongoDB."""
-    g.db = Connection()[DATABASE]
+    """Each page request gets a handle on the pooled MongoDB client.
+
+    Queries made through it are recorded for /admin/metrics.
+
+    """
+    metrics.begin()
+    g.db = metrics.InstrumentedDatabase(db.handle(DATABASE))
+    bus.listen(DATABASE)
+
+
+@APP.before_request
+def start_profile():
+    """Profile this request if an admin asked to, or if it was sampled.
+
+    Admins ask with an `X-DMXM-Profile` header or a `_profile` query
+    argument; the results are listed at /admin/profiles.
+
+    """
+    asked = request.headers.get('X-DMXM-Profile') or \
+        request.args.get('_profile')
+    g.profile_asked = bool(asked) and is_admin()
+    if g.profile_asked or profiler.should_sample():
+        g.profile = profiler.Profile()
+        g.profile.start()
+
+
+@APP.after_request
+def save_profile(response):
+    """Save the profile of this request, if it was being profiled.
+
+    Only admins who asked for the profile are told its name.
+
+    """
+    profile = getattr(g, 'profile', None)
+    if profile:
+        g.profile = None
+        name = profile.stop(request.path)
+        if g.profile_asked:
+            response.headers['X-DMXM-Profile'] = name
+    return response
+
+
+@APP.teardown_request
+def stop_profile(error=None):
+    """Stop a profile that save_profile never saw, e.g. after a 500."""
+    profile = getattr(g, 'profile', None)
+    if profile:
+        g.profile = None
+        profile.stop(request.path)
+
+
+@APP.after_request
+def record_request(response):
+    """File the request's timings under its route; log it if it was slow."""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    req = metrics.end(route)
+    if req and req.elapsed > SLOW_REQUEST:
+        APP.logger.warning('Slow request: %s %s took %.0fms (%d queries: %s)',
+            request.method, request.path, req.elapsed * 1000,
+            len(req.queries), metrics.breakdown(req))
+    return response
+
+
+@APP.errorhandler(AutoReconnect)
+def database_reconnect(error):
+    """MongoDB went away (e.g. `fab kick`); start over with a new pool."""
+    db.reset()
+    return 'The database is restarting, please try again.', 503
+
+
+@APP.context_processor
+def inject_bundle_urls():
+    """Let templates use fingerprinted bundles once they are built."""
+    return {'bundle_url': bundles.url}
 
 
 @APP.context_processor
 def inject_localtime_processing():
     """Give templates a function to convert to Pacific time."""
-    def format_as_localtime(dt):
-        dt = dt.replace(tzinfo=pytz.utc)
-        pacific_tz = pytz.timezone('America/Los_Angeles')
-        return dt.astimezone(pacific_tz)
-    return {'localtime': format_as_localtime}
+    return {'localtime': localtime}
 
 
 ##
+def localtime(dt):
+    """Converts a UTC datetime from MongoDB to Pacific time."""
+    dt = dt.replace(tzinfo=pytz.utc)
+    pacific_tz = pytz.timezone('America/Los_Angeles')
+    return dt.astimezone(pacific_tz)
+
+
+def feed_item(record):
+    """A Post or Chat as sent to live feeds and the JSON API."""
+    return {'id': str(record._id), 'source': record.source,
+        'posted': localtime(record.posted).strftime('%Y-%m-%d %H:%M'),
+        'html': record.html,
+        'private': bool(getattr(record, 'players', None))}
+
+
+def chat_queue():
+    """Returns this process's write-behind queue for chat messages."""
+    global _chat_queue
+
+    with _chat_queue_lock:
+        if _chat_queue is None or _chat_queue.pid != os.getpid():
+            _chat_queue = writebehind.start(DATABASE, 'chats',
+                flushed=chats_flushed)
+        return _chat_queue
+
+
+def chats_flushed(docs):
+    """Counts a write-behind batch and publishes the games it posted to."""
+    repository.chats_added(db.handle(DATABASE), docs)
+    for game in set(doc['game'] for doc in docs):
+        bus.publish(db.handle(DATABASE), 'chats', game)
+
+
+def seen_changed():
+    """Tells other workers the player's seen markers changed.
+
+    Only needed when players are cached at all.
+
+    """
+    if repository.PLAYERS.maxsize:
+        bus.publish(g.db, 'player', session['pid'])
+
+
+def render_template(template, **context):
+    """Renders a template, timing it for the metrics."""
+    with metrics.timer('template'):
+        return flask.render_template(template, **context)
+
+
+def current_user():
+    """Returns the signed-in player, loaded at most once per request."""
+    if not hasattr(g, 'user'):
+        g.user = repository.player(g.db, session['pid'])
+    return g.user
+
+
+def fresh(validator):
+    """Checks the client's cached copy of a page against a validator.
+
+    Returns the page's ETag and whether the client's copy is current.
+    Only If-None-Match is trusted. A date can't tell who the copy was
+    rendered for, or whether the chapter was locked since, so requests
+    with only If-Modified-Since get the full page.
+
+    """
+    etag = sha256(repr((session.get('pid'), validator))).hexdigest()
+
+    if request.if_none_match:
+        return etag, request.if_none_match.contains(etag)
+
+    return etag, False
+
+
+def validated(rv, etag, last_modified=None):
+    """Adds validators to a response, or makes a 304 if `rv` is None."""
+    if rv is None:
+        rv = APP.response_class(status=304)
+
+    rv.set_etag(etag)
+    if last_modified:
+        rv.last_modified = last_modified
+
+    # Pages depend on who is viewing them; always check back with us.
+    rv.headers['Cache-Control'] = 'private, no-cache'
+
+    return rv
+
+
+def sessions_validator(sessions, unread):
+    """Everything sessions.html shows, as a cheap validator."""
+    return [(s._id, s.name, s.started, s.last_poster, unread[s._id],
+        [(c._id, c.name, c.started, unread[c._id]) for c in s.chapters])
+        for s in sessions]
+
+
 def requiresLogin(func):
     """Redirects users to the login if they are not authenticated."""
     @wraps(func)
@@ -100,6 +292,23 @@ def requiresLogin(func):
     return decorated_function
 
 
+def is_admin():
+    """Whether the signed-in player has the admin flag."""
+    return 'pid' in session and bool(current_user()) and \
+        current_user().admin
+
+
+def requiresAdmin(func):
+    """Redirects anybody who isn't a signed-in admin to the homepage."""
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        if not is_admin():
+            return redirect('/')
+        else:
+            return func(*args, **kwargs)
+    return decorated_function
+
+
 ##
 @APP.route('/')
 def homepage():
@@ -113,49 +322,54 @@ def homepage():
         return render_template('login.html')
     else:
         # Lookup sessions that this player is a part of.
-        sessions = []
-        user = g.db.players.find_one({'_id': session['pid']})
-        for sid in user['games']:
-            s = g.db.campaigns.find_one({'_id': sid})
-
-            # Lookup the chapter list that this character is in.
-            chapters = g.db.chapters.find({'game': sid,
-                'players': {'$in': [session['pid']]}}
-                ).sort('started', ASCENDING)
+        sessions = repository.campaigns_with_chapters(g.db, session['pid'],
+            current_user().games)
+        unread = repository.unread(current_user(), sessions)
 
-            s['chapters'] = chapters
+        etag, current = fresh(sessions_validator(sessions, unread))
+        if current:
+            return validated(None, etag)
 
-            sessions.append(s)
-
-        return render_template('sessions.html', sessions=sessions)
+        return validated(make_response(render_template('sessions.html',
+            sessions=sessions, unread=unread)), etag)
 
 
 @APP.route('/games/<gamename>')
 @requiresLogin
 def game_chapters(gamename):
     """Show all chapters in a particular game that we have access to."""
-    user = g.db.players.find_one({'_id': session['pid']})
-    if gamename not in user['games']:
+    if gamename not in current_user().games:
         return redirect('/')
 
     # Get the chapters that this character has access to.
-    s = g.db.campaigns.find_one({'_id': gamename})
-
-    s['chapters'] = g.db.chapters.find({'game': gamename,
-                'players': {'$in': [session['pid']]}},
-    ).sort('started', ASCENDING)
+    sessions = repository.campaigns_with_chapters(g.db, session['pid'],
+        [gamename])
+    unread = repository.unread(current_user(), sessions)
 
-    sessions = [s]
+    etag, current = fresh(sessions_validator(sessions, unread))
+    if current:
+        return validated(None, etag)
 
-    return render_template('sessions.html', sessions=sessions, game=gamename)
+    return validated(make_response(render_template('sessions.html',
+        sessions=sessions, unread=unread, game=gamename)), etag)
 
 
 @APP.route('/games/<gamename>/chat', methods=['POST'])
 @requiresLogin
 def game_post_message(gamename):
     """Post a chat message to the channel for this game."""
-    g.db.chats.insert({'game': gamename, 'body': request.form['post-text'],
-        'source': session['pid'], 'posted': datetime.utcnow()})
+    chat = repository.new_chat(gamename, session['pid'],
+        request.form['post-text'])
+
+    if CHAT_WRITE_BEHIND:
+        chat_queue().put(chat)
+    else:
+        repository.add_chat(g.db, chat)
+        bus.publish(g.db, 'chats', gamename)
+
+    # Your own message isn't news to you.
+    repository.mark_own(g.db, session['pid'], gamename)
+    seen_changed()
 
     game = '/games/%s' % gamename
     ret = request.headers['Referer'] if 'Referer' in request.headers else game
@@ -172,28 +386,163 @@ def game_chapter(gamename, chapter):
     This is the real meat and potatoes of the site.
 
     """
-    current_chapter = g.db.chapters.find_one({'_id': ObjectId(chapter)})
-    posts = g.db.posts.find({'chapter': ObjectId(chapter)}).sort('posted',
-        ASCENDING)
+    current_chapter = repository.chapter(g.db, ObjectId(chapter))
 
     # Current game for the link back.
-    current_game = g.db.campaigns.find_one({'_id': gamename})
+    current_game = repository.campaign(g.db, gamename)
+
+    # Answer reloads of an unchanged page from the newest post and chat.
+    newest_post = repository.newest_post(g.db, ObjectId(chapter))
+    newest_chat = repository.newest_chat(g.db, gamename)
+    last_modified = max(newest_post, newest_chat)
+    last_modified = last_modified[0] if last_modified else None
+
+    etag, current = fresh((current_chapter, current_game.name,
+        current_game.dms, newest_post, newest_chat, request.query_string,
+        render.RENDERER_VERSION))
+    if current:
+        return validated(None, etag, last_modified)
+
+    # Is the current user the DM?
+    is_dm = (session['pid'] in current_game.dms)
+
+    # Counted before loading, so nothing arriving meanwhile is marked
+    # seen without being shown.
+    seen_counts = repository.counts(g.db, gamename, ObjectId(chapter))
+
+    # Only the latest page of posts this player can see; older pages
+    # are linked to.
+    posts, older_posts = repository.posts(g.db, ObjectId(chapter),
+        session['pid'], is_dm, request.args.get('posts_before'), POSTS_PAGE)
 
     # Retrieve chat messages for this game.
-    chats = g.db.chats.find({'game': gamename}).sort('posted', DESCENDING)
+    chats, older_chats = repository.chats(g.db, gamename,
+        request.args.get('chats_before'), CHATS_PAGE)
+
+    # The latest page follows new posts and chat as they come in, over
+    # the live feed or by polling the JSON API.
+    after = {}
+    if newest_post:
+        after['posts_after'] = loaders.encode_cursor(newest_post)
+    if newest_chat:
+        after['chats_after'] = loaders.encode_cursor(newest_chat)
+    stream = None
+    if not request.args:
+        stream = '%s/stream?%s' % (chapter, url_encode(after))
+
+        # The player is caught up; clear this chapter's unread badges.
+        if repository.mark_seen(g.db, current_user(), gamename,
+                ObjectId(chapter), seen_counts):
+            seen_changed()
+
+    return validated(make_response(render_template('chapter.html',
+        posts=posts, chapter=current_chapter, chats=chats, game=gamename,
+        current_game=current_game, is_dm=is_dm, older_posts=older_posts,
+        older_chats=older_chats, stream=stream, **after)), etag,
+        last_modified)
+
+
+@APP.route('/games/<gamename>/chapter/<chapter>/stream')
+@requiresLogin
+def game_chapter_stream(gamename, chapter):
+    """A Server-Sent Events feed of new posts and chat for a chapter.
 
-    cs = []
-    for each in chats:
-        cs.append(each)
+    Every client in this process is served by one watcher; see
+    dmxm.live. Private posts only go to the players they are for.
 
-    cs.reverse()
+    Event ids hold the posts and chats cursors the client has reached,
+    so a browser that reconnects with Last-Event-ID picks up from
+    there instead of from the cursors in the URL.
 
-    # Is the current user the DM?
-    is_dm = (session['pid'] in current_game['dms'])
+    """
+    current_game = repository.campaign(g.db, gamename)
+    if not current_game or gamename not in current_user().games:
+        return redirect('/')
+
+    pid = session['pid']
+    is_dm = pid in current_game.dms
+
+    def accept(collection, doc):
+        return (collection == 'chats' or is_dm or not doc.get('players')
+            or pid in doc['players'])
 
-    return render_template('chapter.html', posts=posts,
-        chapter=current_chapter, chats=cs, game=gamename,
-        current_game=current_game, is_dm=is_dm)
+    reached = {'posts': request.args.get('posts_after', ''),
+        'chats': request.args.get('chats_after', '')}
+    last_event = request.headers.get('Last-Event-ID', '').split(',')
+    if len(last_event) == 2:
+        reached = {'posts': last_event[0], 'chats': last_event[1]}
+
+    posts = ('posts', 'chapter', ObjectId(chapter))
+    chats = ('chats', 'game', gamename)
+    hub = live.hub(DATABASE)
+    sub = hub.subscribe([posts, chats], accept, {
+        posts: reached['posts'], chats: reached['chats']})
+
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while not sub.closed:
+                item = sub.get(KEEPALIVE)
+                if item is None:
+                    yield ': keepalive\n\n'
+                    continue
+
+                collection, doc = item
+                record = (repository.Chat if collection == 'chats'
+                    else repository.Post)(doc)
+                reached[collection] = loaders.cursor(doc)
+                yield 'event: %s\nid: %s,%s\ndata: %s\n\n' % (
+                    collection[:-1], reached['posts'], reached['chats'],
+                    json.dumps(feed_item(record)))
+        finally:
+            hub.unsubscribe(sub)
+
+    return APP.response_class(events(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache'})
+
+
+def no_such_game():
+    """The JSON API's answer for games the player is not in."""
+    rv = jsonify(error='No such game')
+    rv.status_code = 404
+    return rv
+
+
+def delta(records, after):
+    """JSON of the records loaded after the `after` cursor.
+
+    The returned cursor is what the client should send next time.
+
+    """
+    return jsonify(items=[feed_item(record) for record in records],
+        cursor=loaders.encode_cursor((records[-1].posted, records[-1]._id))
+        if records else after)
+
+
+@APP.route('/api/games/<gamename>/chapter/<chapter>/posts')
+@requiresLogin
+def api_chapter_posts(gamename, chapter):
+    """Posts in a chapter newer than a cursor, for polling clients."""
+    current_game = repository.campaign(g.db, gamename)
+    if not current_game or gamename not in current_user().games:
+        return no_such_game()
+
+    after = request.args.get('after')
+    return delta(repository.posts_after(g.db, ObjectId(chapter),
+        session['pid'], session['pid'] in current_game.dms, after,
+        POSTS_PAGE), after)
+
+
+@APP.route('/api/games/<gamename>/chats')
+@requiresLogin
+def api_game_chats(gamename):
+    """Chat messages in a game newer than a cursor, for polling clients."""
+    if gamename not in current_user().games:
+        return no_such_game()
+
+    after = request.args.get('after')
+    return delta(repository.chats_after(g.db, gamename, after, CHATS_PAGE),
+        after)
 
 
 @APP.route('/games/<gamename>/chapter/<chapter>/post', methods=['POST'])
@@ -202,35 +551,130 @@ def game_chapter_post(gamename, chapter):
     """Post a reply to a chapter."""
 
     chapter = ObjectId(chapter)
-    current_chapter = g.db.chapters.find_one({'_id': chapter})
-    if not current_chapter:
+    current_chapter = repository.chapter(g.db, chapter)
+    if not current_chapter or current_chapter.game != gamename:
         return redirect('/')
 
+    # Locked chapters only hide the form; refuse the post as well.
+    if current_chapter.locked:
+        return redirect('/games/%s/chapter/%s#bottom' % (gamename, chapter))
+
     # Determine if this was posted by one of the DMs.
-    campaign = g.db.campaigns.find_one({'_id': gamename}, fields=['dms'])
-    src = 'dm' if session['pid'] in campaign['dms'] else session['pid']
+    campaign = repository.campaign(g.db, gamename)
+    src = 'dm' if session['pid'] in campaign.dms else session['pid']
 
     # Compute inline die rolls.
-    body = dice.process(request.form['post-text'])
-
-    postdata = {'chapter': chapter, 'body': body, 'posted': datetime.utcnow(),
-        'source': src}
+    with metrics.timer('dice'):
+        body = dice.process(request.form['post-text'], rng.stream(gamename))
 
+    players = None
     if 'players' in request.form:
-        postdata['players'] = request.form.getlist('players')
+        players = request.form.getlist('players')
 
-    g.db.posts.insert(postdata)
+    repository.add_post(g.db, current_chapter, src, body, players)
+    bus.publish(g.db, 'posts', chapter)
+    if not players:
+        repository.mark_own(g.db, session['pid'], gamename, chapter)
+        seen_changed()
 
     return redirect('/games/%s/chapter/%s#bottom' % (gamename, chapter))
 
 
+@APP.route('/dice/odds')
+@requiresLogin
+def dice_odds():
+    """Exact odds for a dice expression, for DMs writing a post.
+
+    Takes the expression as `expr` and an optional `target` to get the
+    chance of rolling at least that much.
+
+    """
+    target = request.args.get('target', None, type=int)
+    try:
+        summary = probability.summarize(request.args.get('expr', ''), target)
+    except ValueError as e:
+        summary = {'error': str(e)}
+
+    if not summary:
+        summary = {'error': 'Not a dice expression'}
+
+    rv = jsonify(summary)
+    if 'error' in summary:
+        rv.status_code = 400
+
+    return rv
+
+
+@APP.route('/static/build/<filename>')
+def static_bundle(filename):
+    """Serves a fingerprinted bundle, precompressed if the browser can.
+
+    Bundle names change with their content, so browsers may keep them
+    forever without asking again.
+
+    """
+    mimetype = mimetypes.guess_type(filename)[0]
+    encoding = None
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[name] and os.path.exists(
+                os.path.join(bundles.BUILD, filename + suffix)):
+            encoding = name
+            filename += suffix
+            break
+
+    rv = send_from_directory(bundles.BUILD, filename, mimetype=mimetype)
+    if encoding:
+        rv.headers['Content-Encoding'] = encoding
+    rv.headers['Vary'] = 'Accept-Encoding'
+    rv.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+
+    return rv
+
+
+@APP.route('/admin/metrics')
+@requiresAdmin
+def admin_metrics():
+    """This process's metrics in the Prometheus text format.
+
+    Each mod_wsgi process keeps its own numbers; the connection and queue
+    gauges are labelled with its pid.
+
+    """
+    gauges = db.counters()
+    if _chat_queue is not None:
+        for name, value in _chat_queue.metrics().items():
+            gauges['chat_queue_%s' % name] = value
+
+    lines = ['# TYPE dmxm_%s gauge\ndmxm_%s{pid="%d"} %s' % (name, name,
+        os.getpid(), float(value)) for name, value in sorted(gauges.items())
+        if name != 'pid']
+
+    rv = make_response(metrics.prometheus() + '\n'.join(lines) + '\n')
+    rv.mimetype = 'text/plain'
+    return rv
+
+
+@APP.route('/admin/profiles')
+@requiresAdmin
+def admin_profiles():
+    """Lists the saved request profiles."""
+    return render_template('profiles.html', profiles=profiler.listing())
+
+
+@APP.route('/admin/profiles/<filename>')
+@requiresAdmin
+def admin_profile_download(filename):
+    """Downloads a saved call graph (.prof) or flame graph (.folded)."""
+    return send_from_directory(profiler.PROFILE_DIR, filename,
+        as_attachment=True)
+
+
 @APP.route('/signin', methods=['POST'])
 def signin():
     """Log a user into the system."""
     username = request.form['pid']
-    password = sha256(request.form['password']).hexdigest()
-    user = g.db.players.find_one({'_id': username, 'password': password})
-    if user:
+    if repository.check_password(g.db, username, request.form['password']):
+        bus.publish(g.db, 'player', username)
         session['pid'] = username
         return redirect('/')
     else:
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Write-behind batching of inserts for DM Ex Machina.
+
+
+This is free and unencumbered software released into the public domain.
+
+Anyone is free to copy, modify, publish, use, compile, sell, or
+distribute this software, either in source code form or as a compiled
+binary, for any purpose, commercial or non-commercial, and by any
+means.
+
+In jurisdictions that recognize copyright laws, the author or authors
+of this software dedicate any and all copyright interest in the
+software to the public domain. We make this dedication for the benefit
+of the public at large and to the detriment of our heirs and
+successors. We intend this dedication to be an overt act of
+relinquishment in perpetuity of all present and future rights to this
+software under copyright law.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL THE AUTHORS BE LIABLE FOR ANY CLAIM, DAMAGES OR
+OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+For more information, please refer to <http://unlicense.org/>
+
+"""
+##
+from dmxm import db
+from datetime import datetime
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+import atexit
+import logging
+import os
+import Queue
+import threading
+import time
+
+##
+LOG = logging.getLogger(__name__)
+
+# Times a batch that fails for some other reason than a lost
+# connection is retried before it is given up on.
+RETRIES = 3
+
+
+##
+class WriteBehind(object):
+    """Queues documents and inserts them in batches from a thread.
+
+    A batch is written once `batch` documents are waiting or
+    `interval` seconds have passed since the first of them arrived.
+    When the queue is full, put() blocks for up to `timeout` seconds
+    and then writes the document itself.
+
+    A batch that fails to insert is retried every `interval` seconds,
+    for as long as MongoDB is unreachable and the queue is running.
+    Other errors, and any error while draining, are retried RETRIES
+    times before the batch is logged and dropped. Documents still
+    queued when the process is killed outright are lost too.
+
+    Documents are stamped with `posted` when they are written, which
+    keeps (posted, _id) cursors in this process moving forwards.
+
+    """
+
+    def __init__(self, database, collection, maxsize=1000, batch=100,
+            interval=0.5, timeout=2.0, flushed=None):
+        self.database = database
+        self.collection = collection
+        self.batch = batch
+        self.interval = interval
+        self.timeout = timeout
+        self.flushed = flushed
+        self.pid = os.getpid()
+        self.queue = Queue.Queue(maxsize)
+        self.stats = {'queued': 0, 'written': 0, 'flushes': 0,
+            'overflows': 0, 'failures': 0, 'dropped': 0,
+            'callback_errors': 0, 'flush_seconds': 0.0,
+            'max_flush_seconds': 0.0}
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts the flushing thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def put(self, doc):
+        """Queues `doc`, waiting for room if the queue is full."""
+        try:
+            self.queue.put(doc, True, self.timeout)
+            self._count('queued')
+        except Queue.Full:
+            self._count('overflows')
+            self.write([doc])
+
+    def write(self, docs, retry=False):
+        """Inserts `docs` in one bulk insert and records how long it took.
+
+        A `retry` inserts them one at a time instead, skipping any that
+        an earlier, failed attempt got in. Errors from the `flushed`
+        callback are logged; the documents are stored by then.
+
+        """
+        start = time.time()
+        now = datetime.utcnow()
+        for doc in docs:
+            doc['posted'] = now
+
+        collection = db.handle(self.database)[self.collection]
+        if retry:
+            for doc in docs:
+                try:
+                    collection.insert(doc, safe=True)
+                except DuplicateKeyError:
+                    pass
+        else:
+            collection.insert(docs)
+
+        elapsed = time.time() - start
+        with self._lock:
+            self.stats['written'] += len(docs)
+            self.stats['flushes'] += 1
+            self.stats['flush_seconds'] += elapsed
+            self.stats['max_flush_seconds'] = max(elapsed,
+                self.stats['max_flush_seconds'])
+
+        if self.flushed:
+            try:
+                self.flushed(docs)
+            except Exception:
+                self._count('callback_errors')
+                LOG.exception('Callback failed after writing %d documents '
+                    'to %s', len(docs), self.collection)
+
+    def _flush(self, docs):
+        """Writes a batch from the thread, retrying as described above."""
+        attempts = 0
+        while True:
+            try:
+                self.write(docs, retry=attempts > 0)
+                return
+            except Exception as e:
+                attempts += 1
+                self._count('failures')
+                outage = isinstance(e, AutoReconnect)
+                if outage:
+                    db.reset()
+                if attempts > RETRIES and not (outage and self._running):
+                    self._count('dropped', len(docs))
+                    LOG.exception('Dropped %d documents for %s',
+                        len(docs), self.collection)
+                    return
+                LOG.warning('Writing %d documents to %s failed (%s); '
+                    'retrying', len(docs), self.collection, e)
+                time.sleep(self.interval)
+
+    def _take(self):
+        """Waits for the next batch; returns [] if nothing turned up."""
+        try:
+            docs = [self.queue.get(True, self.interval)]
+        except Queue.Empty:
+            return []
+
+        deadline = time.time() + self.interval
+        while len(docs) < self.batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                docs.append(self.queue.get(True, remaining))
+            except Queue.Empty:
+                break
+        return docs
+
+    def _run(self):
+        """The flushing thread."""
+        while self._running:
+            docs = self._take()
+            if docs:
+                self._flush(docs)
+
+    def drain(self):
+        """Stops the thread and writes whatever is still queued."""
+        self._running = False
+        if self._thread:
+            self._thread.join(self.interval * 2)
+
+        docs = []
+        while True:
+            try:
+                docs.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+            if len(docs) == self.batch:
+                self._flush(docs)
+                docs = []
+        if docs:
+            self._flush(docs)
+
+    def metrics(self):
+        """Returns queue depth and flush counters."""
+        with self._lock:
+            info = dict(self.stats)
+        info['depth'] = self.queue.qsize()
+        info['mean_flush_seconds'] = (info['flush_seconds'] /
+            info['flushes'] if info['flushes'] else 0.0)
+        return info
+
+
+def start(database, collection, **kwargs):
+    """Starts a WriteBehind that is drained when the process exits."""
+    queue = WriteBehind(database, collection, **kwargs)
+    queue.start()
+    atexit.register(queue.drain)
+    return queue